@@ -0,0 +1,257 @@
+"""Benchmark of the offer pipeline with a synthetic workload.
+
+Feeds shaped like `live_data_sb` and subscribers with random criteria are
+generated for a sweep of sizes. Each stage of the pipeline is timed against
+a scratch database.
+"""
+
+import csv
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+
+from hetznerbot.config import config
+from hetznerbot.db import base
+from hetznerbot.helper.cpu import CPU_DATA_PATH, cpu_catalog, import_cpu_csv
+from hetznerbot.helper.diff import offer_snapshot
+from hetznerbot.helper.feed import hetzner_feed
+from hetznerbot.helper.hetzner import (
+    check_offers_for_subscribers,
+    format_offer,
+    format_offers,
+    update_offers,
+)
+from hetznerbot.helper.percolator import percolator
+from hetznerbot.helper.render import render_cache
+from hetznerbot.helper.text import split_text
+from hetznerbot.helper.vectorized import vectorized_matcher
+from hetznerbot.models import Subscriber
+
+DATACENTERS = ["FSN1-DC1", "FSN1-DC5", "FSN1-DC14", "NBG1-DC3", "HEL1-DC2"]
+DISK_SIZES = [240, 256, 480, 512, 960, 1024, 2000, 3000, 4000, 8000, 10000, 16000]
+RAM_SIZES = [16, 32, 64, 128, 256]
+SPECIALS = ["IPv4", "GPU", "iNIC", "HWR", "ECC"]
+
+
+def load_cpu_names(path=CPU_DATA_PATH):
+    """Get the names of all cpus in the cpu data."""
+    with open(path, newline="") as csvfile:
+        return [row["name"] for row in csv.DictReader(csvfile)]
+
+
+def generate_offer(rng, key, cpu_names):
+    """Generate a single offer in the format of the Hetzner feed."""
+    disks = {"nvme": [], "sata": [], "hdd": []}
+    for _ in range(rng.choice([1, 2, 2, 2, 3])):
+        disk_type = rng.choice(list(disks.keys()))
+        disks[disk_type] += [rng.choice(DISK_SIZES)] * rng.choice([1, 2, 2, 3, 4])
+
+    return {
+        "key": key,
+        "cpu": rng.choice(cpu_names),
+        "ram_size": rng.choice(RAM_SIZES),
+        "datacenter": rng.choice(DATACENTERS),
+        "serverDiskData": {
+            **disks,
+            # Hetzner repeats all disks in this category.
+            "general": disks["nvme"] + disks["sata"] + disks["hdd"],
+        },
+        "is_ecc": rng.random() < 0.3,
+        "specials": [special for special in SPECIALS if rng.random() < 0.2],
+        "price": rng.randint(30, 250),
+    }
+
+
+def generate_offers(rng, count, cpu_names):
+    """Generate a feed with `count` offers."""
+    return [generate_offer(rng, 1000000 + key, cpu_names) for key in range(count)]
+
+
+def mutate_offers(rng, offers, cpu_names, share=0.05):
+    """Get the next feed, in which some offers changed, vanished or appeared."""
+    next_key = max(offer["key"] for offer in offers) + 1
+    mutated = []
+    for offer in offers:
+        roll = rng.random()
+        if roll < share:
+            mutated.append({**offer, "price": offer["price"] - 1})
+        elif roll < share * 1.2:
+            continue
+        else:
+            mutated.append(offer)
+
+    for key in range(next_key, next_key + int(len(offers) * share * 0.2)):
+        mutated.append(generate_offer(rng, key, cpu_names))
+
+    return mutated
+
+
+def generate_subscriber(rng, chat_id):
+    """Generate an active and authorized subscriber with random criteria."""
+    subscriber = Subscriber(chat_id)
+    subscriber.active = True
+    subscriber.authorized = True
+
+    subscriber.hdd_count = rng.randint(1, 4)
+    subscriber.hdd_size = rng.choice([0, 250, 500, 1000, 2000, 4000])
+    subscriber.raid = None
+    if subscriber.hdd_count >= 3 and rng.random() < 0.5:
+        subscriber.raid = "raid5" if subscriber.hdd_count == 3 else "raid6"
+    subscriber.after_raid = rng.choice([0, 1000, 4000, 8000])
+
+    subscriber.threads = rng.choice([1, 4, 8, 16])
+    subscriber.release_date = rng.choice([2000, 2010, 2015, 2018])
+    subscriber.multi_rating = rng.choice([0, 2000, 5000, 10000])
+    subscriber.single_rating = rng.choice([0, 500, 1000, 2000])
+
+    subscriber.price = rng.randint(40, 250)
+    subscriber.ram = rng.choice(RAM_SIZES)
+    subscriber.datacenter = rng.choice([None, None, None, "FSN", "NBG", "HEL"])
+
+    subscriber.ipv4 = rng.random() < 0.1
+    subscriber.ecc = rng.random() < 0.1
+    subscriber.inic = False
+    subscriber.hwr = False
+
+    return subscriber
+
+
+def get_commit():
+    """Get the current git commit, if possible."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return result.stdout.strip()
+
+
+def reset(engine):
+    """Recreate the scratch database and drop all in-memory state."""
+    base.metadata.drop_all(bind=engine)
+    base.metadata.create_all(bind=engine)
+
+    offer_snapshot.clear()
+    hetzner_feed.reset()
+    render_cache.clear()
+    cpu_catalog.cpus = None
+    percolator.index = None
+    vectorized_matcher.clear()
+
+
+class Benchmark:
+    """Run the pipeline for a sweep of workload sizes and time each stage."""
+
+    def __init__(self, engine, session_factory, seed=0):
+        """Create a new benchmark, which counts all queries of the given engine."""
+        self.engine = engine
+        self.session_factory = session_factory
+        self.seed = seed
+        self.cpu_names = load_cpu_names()
+        self.queries = 0
+        self.results = []
+
+        event.listen(engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        """Count every statement that is sent to the database."""
+        self.queries += 1
+
+    @contextmanager
+    def stage(self, name, offers, subscribers):
+        """Measure the wall time and the queries of a single stage."""
+        queries = self.queries
+        start = time.perf_counter()
+        yield
+        self.results.append(
+            {
+                "stage": name,
+                "offers": offers,
+                "subscribers": subscribers,
+                "seconds": time.perf_counter() - start,
+                "queries": self.queries - queries,
+            }
+        )
+
+    def run(self, offer_counts, subscriber_counts):
+        """Run the benchmark for all combinations of sizes."""
+        for offer_count in offer_counts:
+            for subscriber_count in subscriber_counts:
+                # Progress goes to stderr, so the results can be piped.
+                print(
+                    f"Running {offer_count} offers, {subscriber_count} subscribers",
+                    file=sys.stderr,
+                )
+                self.run_once(offer_count, subscriber_count)
+
+    def run_once(self, offer_count, subscriber_count):
+        """Run all stages for a single workload size."""
+        rng = random.Random(f"{self.seed}-{offer_count}-{subscriber_count}")
+        offers = generate_offers(rng, offer_count, self.cpu_names)
+        next_offers = mutate_offers(rng, offers, self.cpu_names)
+
+        reset(self.engine)
+        session = self.session_factory()
+        import_cpu_csv(session, verbose=False)
+        session.add_all(
+            generate_subscriber(rng, chat_id) for chat_id in range(subscriber_count)
+        )
+        session.commit()
+        cpu_catalog.refresh(session)
+
+        def stage(name):
+            return self.stage(name, offer_count, subscriber_count)
+
+        with stage("update_offers"):
+            diff = update_offers(session, offers)
+        with stage("check_offers_for_subscribers"):
+            check_offers_for_subscribers(session)
+        offer_snapshot.apply(diff)
+
+        with stage("update_offers (incremental)"):
+            diff = update_offers(session, next_offers)
+        with stage("check_offers_for_subscribers (incremental)"):
+            if not diff.is_empty():
+                check_offers_for_subscribers(session, diff)
+        offer_snapshot.apply(diff)
+
+        subscribers = session.query(Subscriber).all()
+        with stage("format_offers"):
+            for subscriber in subscribers:
+                format_offers(session, subscriber, subscriber.offer_subscriber)
+
+        # Formatted offers of all subscribers, which are split into messages.
+        formatted = []
+        for subscriber in subscribers:
+            raid = subscriber.raid if subscriber.raid in ["raid5", "raid6"] else None
+            formatted.append(
+                [
+                    format_offer(session, entry.offer, raid, entry.new)
+                    for entry in subscriber.offer_subscriber
+                ]
+            )
+        with stage("split_text"):
+            for offers in formatted:
+                split_text(offers, max_chunks=5)
+
+        session.rollback()
+        session.close()
+
+    def get_report(self):
+        """Get the results in a format, that can be compared across commits."""
+        return {
+            "commit": get_commit(),
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "matching_mode": config["matching"]["mode"],
+            "seed": self.seed,
+            "results": self.results,
+        }
@@ -2,6 +2,7 @@ from telegram.constants import ParseMode
 
 from hetznerbot.config import config
 from hetznerbot.helper import get_subscriber_info, help_text
+from hetznerbot.helper.executor import run_sync
 from hetznerbot.helper.hetzner import check_all_offers_for_subscriber, send_offers
 from hetznerbot.helper.session import session_wrapper
 from hetznerbot.models.subscriber import Subscriber
@@ -26,7 +27,8 @@ async def info(bot, update, session, subscriber):
 @session_wrapper()
 async def get_offers(bot, update, session, subscriber):
     """Get the newest hetzner offers."""
-    check_all_offers_for_subscriber(session, subscriber)
+    if not subscriber.is_matched_by_job():
+        await run_sync(check_all_offers_for_subscriber, session, subscriber)
     await send_offers(bot, subscriber, session, get_all=True)
 
 
@@ -119,28 +121,34 @@ async def set_parameter(bot, update, session, subscriber):
 
         value = bool(value)
 
+    # Only re-match this subscriber if the criteria actually changed.
+    changed = getattr(subscriber, name) != value
+    matched = subscriber.is_matched_by_job()
     setattr(subscriber, name, value)
     session.add(subscriber)
-    session.commit()
+    await run_sync(session.commit)
 
     await chat.send_message(f"*{name}* changed to {value}", parse_mode="Markdown")
 
-    check_all_offers_for_subscriber(session, subscriber)
+    if changed or not matched:
+        await run_sync(check_all_offers_for_subscriber, session, subscriber)
     await send_offers(bot, subscriber, session)
 
 
 @session_wrapper()
 async def start(bot, update, session, subscriber):
     """Start the bot."""
+    matched = subscriber.is_matched_by_job()
     subscriber.active = True
     session.add(subscriber)
-    session.commit()
+    await run_sync(session.commit)
 
     await bot.send_message(chat_id=update.message.chat_id, text=help_text)
     text = "You will now receive offers. Type /help for more info."
     await bot.send_message(chat_id=update.message.chat_id, text=text)
 
-    check_all_offers_for_subscriber(session, subscriber)
+    if not matched:
+        await run_sync(check_all_offers_for_subscriber, session, subscriber)
     await send_offers(bot, subscriber, session)
 
 
@@ -149,7 +157,7 @@ async def stop(bot, update, session, subscriber):
     """Stop the bot."""
     subscriber.active = False
     session.add(subscriber)
-    session.commit()
+    await run_sync(session.commit)
 
     text = "You won't receive any more offers."
     await bot.send_message(chat_id=update.message.chat_id, text=text)
@@ -167,18 +175,24 @@ async def authorize(bot, update, session, subscriber):
     chat_id = update.message.text.split(" ")[1]
 
     # Get the subscriber
-    target_subscriber = Subscriber.get_or_create(session, chat_id)
+    target_subscriber = await run_sync(Subscriber.get_or_create, session, chat_id)
+    target_chat_id = target_subscriber.chat_id
 
     # Check if they are already authorized
     if target_subscriber.authorized:
-        text = f"User {target_subscriber.chat_id} is already authorized."
+        text = f"User {target_chat_id} is already authorized."
         await bot.send_message(chat_id=update.message.chat_id, text=text)
         return
 
     # Authorize and eventually create the subscriber
     target_subscriber.authorized = True
+    matched = target_subscriber.is_matched_by_job()
     session.add(target_subscriber)
-    session.commit()
+    await run_sync(session.commit)
 
-    text = f"User {target_subscriber.chat_id} has been authorized."
+    text = f"User {target_chat_id} has been authorized."
     await bot.send_message(chat_id=update.message.chat_id, text=text)
+
+    # From now on, the job only matches changed offers for this subscriber.
+    if matched:
+        await run_sync(check_all_offers_for_subscriber, session, target_subscriber)
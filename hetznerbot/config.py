@@ -11,13 +11,23 @@ default_config = {
         "worker_count": 5,
         "admin": "nukesor",
         "admin_id": 123,
+        # The Bot API server. Point this at the fake server of the load test
+        # with "http://127.0.0.1:8081/bot".
+        "base_url": "https://api.telegram.org/bot",
     },
     "database": {
         "sql_uri": "postgresql://localhost/hetznerbot",
+        # Run all database work on a bounded thread pool instead of the event loop.
+        # Each thread uses its own connection, so the thread count shouldn't
+        # exceed the size of the connection pool (5 + 10 overflow).
+        "threaded": False,
+        "thread_count": 5,
     },
     "logging": {
         "sentry_enabled": False,
         "sentry_token": "",
+        # Share of jobs and commands that are traced. 0 disables tracing.
+        "sentry_traces_sample_rate": 0.0,
     },
     "webhook": {
         "enabled": False,
@@ -26,8 +36,96 @@ default_config = {
         "cert_path": "/path/to/cert.pem",
         "port": 7000,
     },
+    "metrics": {
+        # Serve Prometheus metrics. Requires the `metrics` extra.
+        "enabled": False,
+        "listen": "127.0.0.1",
+        "port": 7001,
+    },
+    "profiler": {
+        # Count and time all statements of each job and command.
+        # The statements, which took the most time, are logged afterwards.
+        "enabled": False,
+        "top": 10,
+        # Warn, if a job or command runs more statements. 0 disables the budget.
+        "query_budget": 0,
+    },
+    "hetzner": {
+        "url": "https://www.hetzner.com/_resources/app/data/app/live_data_sb_EUR.json",
+        # Timeouts in seconds
+        "connect_timeout": 10,
+        "read_timeout": 30,
+        # Keep idle connections around for longer than the polling interval,
+        # so the TLS connection can be reused by the next cycle.
+        "keepalive_expiry": 300,
+    },
+    "matching": {
+        # How subscribers are matched against offers:
+        # - "query" runs a separate query for each subscriber.
+        # - "set" matches all subscribers with a single query.
+        # - "vectorized" matches against in-memory numpy columns of all offers.
+        #   Requires the `vectorized` extra.
+        # - "percolator" routes changed offers through an index of all subscribers.
+        "mode": "query",
+    },
+    "dispatch": {
+        # Telegram allows about 30 messages per second overall
+        # and about one message per second in a single chat.
+        "global_rate": 30,
+        "chat_rate": 1,
+        # How often a message is retried after hitting the flood control.
+        "max_retries": 3,
+        # The outbox of pending notifications is drained every few seconds.
+        "outbox_interval": 5,
+        # The maximum amount of notifications that's delivered in one go.
+        "batch_size": 1000,
+        # Failed deliveries are retried after `retry_delay * attempts` seconds,
+        # until they failed `max_attempts` times.
+        "retry_delay": 60,
+        "max_attempts": 5,
+    },
+    "cluster": {
+        # Run multiple replicas of the bot against the same database.
+        # Requires the webhook mode, so every replica can serve commands.
+        "enabled": False,
+        # Only the replica that holds the leader lock polls Hetzner and matches
+        # offers. The outbox is partitioned between the replicas by chat id.
+        # Each replica needs a unique index between 0 and `replicas - 1`.
+        "replicas": 1,
+        "replica": 0,
+    },
+    "history": {
+        # Price changes older than this many days are downsampled to the last
+        # price of each day. 0 disables the downsampling.
+        "downsample_after": 30,
+        # History older than this many days is deleted. 0 keeps it forever.
+        "retention_days": 0,
+    },
+    "recorder": {
+        # Archive every fetched feed as a compressed snapshot.
+        "enabled": False,
+        "path": "snapshots",
+        # Only store the difference to the previous snapshot.
+        "delta": True,
+        # The amount of delta snapshots between two full snapshots.
+        "full_interval": 60,
+    },
 }
 
+
+def add_defaults(loaded_config, defaults):
+    """Add missing sections and keys of the default config to the loaded config.
+
+    This allows us to introduce new options without breaking existing config files.
+    """
+    for section, values in defaults.items():
+        loaded_section = loaded_config.setdefault(section, {})
+        for key, value in values.items():
+            loaded_section.setdefault(key, value)
+
+    return loaded_config
+
+
 config_path = os.path.expanduser("~/.config/hetznerbot.toml")
 
 if not os.path.exists(config_path):
@@ -36,4 +134,4 @@ if not os.path.exists(config_path):
     print("Please adjust the configuration file at '~/.config/hetznerbot.toml'")
     sys.exit(1)
 else:
-    config = toml.load(config_path)
+    config = add_defaults(toml.load(config_path), default_config)
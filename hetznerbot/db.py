@@ -11,6 +11,13 @@ base = declarative_base()
 
 
 def get_session():
-    """Get a new db session."""
+    """Get a new db session.
+
+    With threaded database access, the work of a single session is spread
+    over multiple threads. The session mustn't be bound to a thread in that case.
+    """
+    if config["database"]["threaded"]:
+        return sessionmaker(bind=engine)()
+
     session = scoped_session(sessionmaker(bind=engine))
     return session
@@ -0,0 +1,190 @@
+"""Local stand-in for the Telegram Bot API.
+
+Only `getMe` and `sendMessage` are supported. Latency, flood control and the
+errors of blocked or deleted chats are simulated, so message delivery can be
+load-tested without sending a single real message.
+Point the bot at the server by setting `telegram.base_url` to
+`http://<listen>:<port>/bot`.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+
+from tornado.web import Application, RequestHandler
+
+# Outcomes of a request.
+OK = "ok"
+RETRY_AFTER = "retry_after"
+FORBIDDEN = "forbidden"
+NOT_FOUND = "chat_not_found"
+
+ERRORS = {
+    RETRY_AFTER: (429, "Too Many Requests: retry after {retry_after}"),
+    FORBIDDEN: (403, "Forbidden: bot was blocked by the user"),
+    NOT_FOUND: (400, "Bad Request: chat not found"),
+}
+
+
+class FakeTelegram:
+    """Answer Bot API requests with simulated latency and errors.
+
+    Whether a chat blocked the bot or doesn't exist is decided once per chat.
+    Flood control errors are raised randomly and whenever more than
+    `flood_limit` messages have been sent within the last second.
+    """
+
+    def __init__(
+        self,
+        latency=0.05,
+        jitter=0.5,
+        retry_after_rate=0.0,
+        retry_after=1,
+        forbidden_rate=0.0,
+        not_found_rate=0.0,
+        flood_limit=0,
+        seed=0,
+    ):
+        """Create a new fake server. `jitter` is relative to the latency."""
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.not_found_rate = not_found_rate
+        self.flood_limit = flood_limit
+        self.rng = random.Random(seed)
+
+        self.chats = {}
+        self.recent = deque()
+        self.outcomes = Counter()
+        self.message_id = 0
+        self.server = None
+
+    def get_chat_outcome(self, chat_id):
+        """Decide once, whether a chat can be reached at all."""
+        if chat_id not in self.chats:
+            roll = self.rng.random()
+            if roll < self.forbidden_rate:
+                self.chats[chat_id] = FORBIDDEN
+            elif roll < self.forbidden_rate + self.not_found_rate:
+                self.chats[chat_id] = NOT_FOUND
+            else:
+                self.chats[chat_id] = OK
+
+        return self.chats[chat_id]
+
+    def is_flooded(self):
+        """Check the number of messages within the last second against the limit."""
+        if self.flood_limit <= 0:
+            return False
+
+        now = time.monotonic()
+        while len(self.recent) > 0 and self.recent[0] <= now - 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.flood_limit:
+            return True
+
+        self.recent.append(now)
+        return False
+
+    async def send_message(self, chat_id, text):
+        """Handle a `sendMessage` request.
+
+        Returns the outcome and the message, if it has been sent.
+        """
+        delay = self.latency * (1 + self.jitter * (2 * self.rng.random() - 1))
+        await asyncio.sleep(max(delay, 0))
+
+        outcome = self.get_chat_outcome(chat_id)
+        if outcome == OK and (
+            self.rng.random() < self.retry_after_rate or self.is_flooded()
+        ):
+            outcome = RETRY_AFTER
+        self.outcomes[outcome] += 1
+
+        if outcome != OK:
+            return outcome, None
+
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+        return outcome, message
+
+    def get_application(self):
+        """Get the tornado application, which serves the Bot API."""
+        return Application(
+            [(r"/bot[^/]+/(\w+)", BotApiHandler, {"fake": self})],
+            # Don't log every single request, errors are expected.
+            log_function=lambda handler: None,
+        )
+
+    def start(self, listen, port):
+        """Start serving on the running event loop."""
+        self.server = self.get_application().listen(port, address=listen)
+
+    def stop(self):
+        """Stop serving."""
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+
+class BotApiHandler(RequestHandler):
+    """Dispatch Bot API methods to the fake server."""
+
+    def initialize(self, fake):
+        """Remember the fake server."""
+        self.fake = fake
+
+    def respond(self, status, body):
+        """Send a JSON response in the format of the Bot API."""
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(body))
+
+    def respond_error(self, outcome):
+        """Send the error response of an outcome."""
+        status, description = ERRORS[outcome]
+        body = {
+            "ok": False,
+            "error_code": status,
+            "description": description.format(retry_after=self.fake.retry_after),
+        }
+        if outcome == RETRY_AFTER:
+            body["parameters"] = {"retry_after": self.fake.retry_after}
+
+        self.respond(status, body)
+
+    async def post(self, method):
+        """Handle a single Bot API call."""
+        # Method names are case-insensitive.
+        method = method.lower()
+        if method == "getme":
+            bot = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Hetznerbot",
+                "username": "hetznerbot",
+            }
+            self.respond(200, {"ok": True, "result": bot})
+        elif method == "sendmessage":
+            chat_id = int(self.get_argument("chat_id"))
+            text = self.get_argument("text")
+            outcome, message = await self.fake.send_message(chat_id, text)
+            if message is None:
+                self.respond_error(outcome)
+            else:
+                self.respond(200, {"ok": True, "result": message})
+        else:
+            self.respond(
+                404, {"ok": False, "error_code": 404, "description": "Not Found"}
+            )
+
+    get = post
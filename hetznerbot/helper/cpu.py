@@ -0,0 +1,117 @@
+"""Cpu data helper functions."""
+
+import csv
+from collections import namedtuple
+from threading import RLock
+
+from sqlalchemy import select, update
+
+from hetznerbot.models import Cpu, Offer, VersionStamp
+
+CPU_DATA_PATH = "data/cpu_data.csv"
+
+# Name of the version stamp, which is bumped on every import.
+CPU_VERSION = "cpu"
+
+CpuStats = namedtuple(
+    "CpuStats",
+    ["threads", "release_date", "multi_thread_rating", "single_thread_rating"],
+)
+
+
+def import_cpu_csv(session, path=CPU_DATA_PATH, verbose=True):
+    """Import cpu data from a csv file into the database."""
+    with open(path, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        known_cpus = []
+        for row in reader:
+            # Check for duplicate entries in data
+            if row["name"] in known_cpus:
+                print(f"DUPLICATE CPU: {row['name']}")
+                continue
+            known_cpus.append(row["name"])
+
+            cpu = session.get(Cpu, row["name"])
+
+            if cpu is None:
+                if verbose:
+                    print(f"Adding new CPU {row['name']}")
+                cpu = Cpu(row["name"].strip())
+                session.add(cpu)
+            elif verbose:
+                print(f"Updating existing CPU {row['name']}")
+
+            cpu.threads = row["threads"].strip()
+            cpu.release_date = row["release_date"].strip()
+            cpu.multi_thread_rating = row["multi_thread_rating"].strip()
+            cpu.single_thread_rating = row["single_thread_rating"].strip()
+
+        # Update the denormalized cpu stats of all offers.
+        session.flush()
+        session.execute(
+            update(Offer)
+            .where(Offer.cpu == Cpu.name)
+            .values(
+                cpu_threads=Cpu.threads,
+                cpu_release_date=Cpu.release_date,
+                cpu_multi_rating=Cpu.multi_thread_rating,
+                cpu_single_rating=Cpu.single_thread_rating,
+            )
+        )
+
+        # Let running bots know that they have to reload their cpu catalog.
+        VersionStamp.bump(session, CPU_VERSION)
+        session.commit()
+
+
+def load_cpus(session):
+    """Get the stats of all cpus by name."""
+    query = select(
+        Cpu.name,
+        Cpu.threads,
+        Cpu.release_date,
+        Cpu.multi_thread_rating,
+        Cpu.single_thread_rating,
+    )
+    return {name: CpuStats(*stats) for name, *stats in session.execute(query)}
+
+
+class CpuCatalog:
+    """In-memory stats of all cpus by name.
+
+    The cpu table only changes, when cpu data is imported. The catalog is
+    reloaded, once the version stamp of the cpu data has been bumped.
+    It's guarded by a lock for threaded database access.
+    """
+
+    cpus = None
+    version = None
+
+    def __init__(self):
+        """Create a new, empty catalog."""
+        self.lock = RLock()
+
+    def refresh(self, session):
+        """Reload the catalog, if cpu data has been imported in the meantime.
+
+        Returns whether the catalog has been reloaded.
+        """
+        with self.lock:
+            version = VersionStamp.get_version(session, CPU_VERSION)
+            if self.cpus is not None and version == self.version:
+                return False
+
+            self.cpus = load_cpus(session)
+            self.version = version
+            return True
+
+    def get_cpus(self, session):
+        """Get all cpus by name. They're only loaded, if that hasn't happened yet."""
+        with self.lock:
+            if self.cpus is None:
+                self.refresh(session)
+
+            return self.cpus
+
+
+cpu_catalog = CpuCatalog()
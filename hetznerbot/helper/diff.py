@@ -0,0 +1,223 @@
+"""In-memory diff between consecutive offer feeds."""
+
+from collections import Counter
+
+from sqlalchemy import select
+
+from hetznerbot.helper.disk_type import DiskType
+from hetznerbot.models import Offer, OfferDisk
+
+# Name of the version stamp, which is bumped whenever offers are updated.
+OFFER_VERSION = "offer"
+
+
+def normalize_offer(incoming_offer):
+    """Convert an offer of the feed into the record that's stored in the database.
+
+    Disks are represented as a sorted tuple of `(type name, size, amount)`.
+    """
+    disks = Counter()
+    for disk_type, disk_sizes in incoming_offer["serverDiskData"].items():
+        # skip general, it just repeats the info of other more specific categories.
+        if disk_type == "general":
+            continue
+
+        for size in disk_sizes:
+            disks[(DiskType[disk_type].name, size)] += 1
+
+    specials = incoming_offer["specials"]
+    ipv4 = "IPv4" in specials
+
+    # Calculate the price in cents
+    price = incoming_offer["price"] * 100
+    if ipv4:
+        # Ipv4 is an extra 1.70€
+        price += 170
+
+    disks = tuple(
+        sorted((name, size, amount) for (name, size), amount in disks.items())
+    )
+
+    return {
+        "key": incoming_offer["key"],
+        "cpu": incoming_offer["cpu"].strip(),
+        "ram": incoming_offer["ram_size"],
+        "datacenter": incoming_offer["datacenter"],
+        "disks": disks,
+        "disk_signature": get_disk_signature(disks),
+        "ecc": incoming_offer["is_ecc"],
+        "ipv4": ipv4,
+        "inic": "iNIC" in specials,
+        "hwr": "HWR" in specials,
+        "price": price,
+    }
+
+
+def load_records(session):
+    """Load all active offers from the database as normalized records."""
+    disks = {}
+    query = (
+        select(OfferDisk.offer_id, OfferDisk.type, OfferDisk.size, OfferDisk.amount)
+        .join(Offer)
+        .where(Offer.deactivated.is_(False))
+    )
+    for offer_id, disk_type, size, amount in session.execute(query):
+        disks.setdefault(offer_id, []).append((disk_type.name, size, amount))
+
+    records = {}
+    for offer in session.scalars(select(Offer).where(Offer.deactivated.is_(False))):
+        records[offer.id] = {
+            "key": offer.id,
+            "cpu": offer.cpu,
+            "ram": offer.ram,
+            "datacenter": offer.datacenter,
+            "disks": tuple(sorted(disks.get(offer.id, []))),
+            "ecc": offer.ecc,
+            "ipv4": offer.ipv4,
+            "inic": offer.inic,
+            "hwr": offer.hwr,
+            "price": offer.price,
+        }
+
+    return records
+
+
+def get_disk_signature(disks):
+    """Get a compact, canonical string for the sorted disk tuple of a record.
+
+    E.g. `hdd:2000x2,nvme:512x1`.
+    """
+    return ",".join(f"{disk_type}:{size}x{amount}" for disk_type, size, amount in disks)
+
+
+def get_disk_stats(disks):
+    """Get the derived disk columns of an offer from its sorted disk tuple.
+
+    Raid capacities are `None`, if no disk group is large enough for that raid.
+    """
+    stats = {
+        "disk_count": 0,
+        "smallest_disk_size": None,
+        "largest_disk_size": None,
+        "raid5_capacity": None,
+        "raid6_capacity": None,
+    }
+    for _, size, amount in disks:
+        stats["disk_count"] += amount
+        stats["smallest_disk_size"] = min(size, stats["smallest_disk_size"] or size)
+        stats["largest_disk_size"] = max(size, stats["largest_disk_size"] or size)
+
+        if amount >= 3:
+            capacity = (amount - 1) * size
+            stats["raid5_capacity"] = max(capacity, stats["raid5_capacity"] or 0)
+        if amount >= 4:
+            capacity = (amount - 2) * size
+            stats["raid6_capacity"] = max(capacity, stats["raid6_capacity"] or 0)
+
+    return stats
+
+
+def get_hardware_fingerprint(record):
+    """Get a fingerprint of everything but the price of an offer record."""
+    return hash(
+        (
+            record["cpu"],
+            record["ram"],
+            record["datacenter"],
+            record["disk_signature"],
+            record["ecc"],
+            record["ipv4"],
+            record["inic"],
+            record["hwr"],
+        )
+    )
+
+
+class OfferDiff:
+    """The changes of a feed compared to the previous one.
+
+    If there's no previous feed, the diff is `full` and all offers count as added.
+    """
+
+    def __init__(self, full):
+        """Create a new, empty diff."""
+        self.full = full
+
+        self.added = []
+        self.removed = []
+        self.price_changed = []
+        self.hardware_changed = []
+
+        # The complete state after this diff has been applied.
+        self.records = {}
+        self.fingerprints = {}
+
+    def get_changed_records(self):
+        """Get all records, which are new or changed in any way."""
+        changed = {record["key"]: record for record in self.added}
+        for record in self.price_changed + self.hardware_changed:
+            changed[record["key"]] = record
+
+        return list(changed.values())
+
+    def get_offer_ids(self):
+        """Get the ids of all added and changed offers.
+
+        Returns `None` for full diffs, as all offers are affected.
+        """
+        if self.full:
+            return None
+
+        return {record["key"] for record in self.get_changed_records()}
+
+    def is_empty(self):
+        """Check whether nothing changed at all."""
+        return not self.full and len(self.get_changed_records() + self.removed) == 0
+
+
+class OfferSnapshot:
+    """The normalized offers of the last processed feed.
+
+    The snapshot is only replaced once a diff has been fully processed.
+    """
+
+    records = None
+    fingerprints = None
+
+    def diff(self, records):
+        """Compare normalized offer records to this snapshot."""
+        diff = OfferDiff(full=self.records is None)
+
+        for record in records:
+            key = record["key"]
+            fingerprint = (get_hardware_fingerprint(record), record["price"])
+            diff.records[key] = record
+            diff.fingerprints[key] = fingerprint
+
+            if diff.full or key not in self.fingerprints:
+                diff.added.append(record)
+                continue
+
+            previous_fingerprint = self.fingerprints[key]
+            if previous_fingerprint[0] != fingerprint[0]:
+                diff.hardware_changed.append(record)
+            if previous_fingerprint[1] != fingerprint[1]:
+                diff.price_changed.append(record)
+
+        if not diff.full:
+            diff.removed = list(self.records.keys() - diff.records.keys())
+
+        return diff
+
+    def apply(self, diff):
+        """Make the state after a processed diff the new snapshot."""
+        self.records = diff.records
+        self.fingerprints = diff.fingerprints
+
+    def clear(self):
+        """Forget the snapshot. The next diff will be a full one."""
+        self.records = None
+        self.fingerprints = None
+
+
+offer_snapshot = OfferSnapshot()
@@ -0,0 +1,343 @@
+"""Concurrent, rate-limited delivery of messages to many chats."""
+
+import asyncio
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.orm import contains_eager
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from hetznerbot.config import config
+from hetznerbot.helper.cpu import cpu_catalog
+from hetznerbot.helper.executor import run_sync
+from hetznerbot.helper.hetzner import build_offer_messages
+from hetznerbot.helper.leader import leader_lock
+from hetznerbot.helper.metrics import metrics
+from hetznerbot.models import Notification, Offer, OfferSubscriber, Subscriber
+from hetznerbot.sentry import sentry
+
+# Delivery statuses of a chat.
+DELIVERED = "delivered"
+FAILED = "failed"
+UNREACHABLE = "unreachable"
+
+
+class TokenBucket:
+    """Allow `rate` actions per second with bursts of up to `capacity` actions."""
+
+    def __init__(self, rate, capacity):
+        """Create a new, full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def pause(self, seconds):
+        """Don't hand out any tokens for some time."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def get_retry_seconds(error):
+    """Get the seconds to wait from a `RetryAfter` error."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+
+    return retry_after
+
+
+class Dispatcher:
+    """Send messages to many chats concurrently within Telegram's rate limits.
+
+    Messages of a single chat are sent in order.
+    """
+
+    def __init__(self, bot):
+        """Create a new dispatcher for a bot."""
+        dispatch_config = config["dispatch"]
+        self.bot = bot
+        self.chat_rate = dispatch_config["chat_rate"]
+        self.max_retries = dispatch_config["max_retries"]
+
+        # Telegram's limits apply to the bot, so they're shared by all replicas.
+        global_rate = dispatch_config["global_rate"]
+        if config["cluster"]["enabled"]:
+            global_rate /= config["cluster"]["replicas"]
+
+        # No bursts, as Telegram's limits apply to any window of one second.
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_buckets = {}
+
+    def get_chat_bucket(self, chat_id):
+        """Get the bucket of a single chat."""
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+
+        return self.chat_buckets[chat_id]
+
+    async def send(self, message):
+        """Send a single message. Retries after hitting the flood control."""
+        chat_bucket = self.get_chat_bucket(message["chat_id"])
+        retries = 0
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                result = await self.bot.send_message(**message)
+                metrics.count_message()
+                return result
+            except RetryAfter as error:
+                metrics.count_error(error)
+                if retries >= self.max_retries:
+                    raise
+
+                # Flood control applies to the whole bot, so everybody has to wait.
+                retries += 1
+                self.global_bucket.pause(get_retry_seconds(error))
+
+    async def deliver(self, chat_id, messages):
+        """Send all messages of a single chat.
+
+        Returns the status of the delivery and the amount of sent messages.
+        """
+        sent = 0
+        try:
+            for message in messages:
+                await self.send(message)
+                sent += 1
+        except RetryAfter:
+            # Flood control errors have already been counted.
+            print(f"Failed to send offers to chat {chat_id}")
+            sentry.capture_exception(tags={"handler": "dispatch"})
+            return FAILED, sent
+        except BadRequest as e:
+            metrics.count_error(e)
+            if e.message == "Chat not found":
+                return UNREACHABLE, sent
+            print(f"Failed to send offers to chat {chat_id}")
+            sentry.capture_exception(tags={"handler": "dispatch"})
+            return FAILED, sent
+        # Bot was removed from group
+        except Forbidden as e:
+            metrics.count_error(e)
+            return UNREACHABLE, sent
+        except Exception as e:
+            metrics.count_error(e)
+            print(f"Failed to send offers to chat {chat_id}")
+            sentry.capture_exception(tags={"handler": "dispatch"})
+            return FAILED, sent
+
+        return DELIVERED, sent
+
+    async def dispatch(self, messages):
+        """Send messages to all chats concurrently.
+
+        `messages` maps chat ids to the list of messages for that chat.
+        Returns the delivery status and the amount of sent messages of each chat.
+        """
+        chat_ids = list(messages.keys())
+        statuses = await asyncio.gather(
+            *(self.deliver(chat_id, messages[chat_id]) for chat_id in chat_ids)
+        )
+
+        return dict(zip(chat_ids, statuses, strict=True))
+
+
+async def deliver_notifications(session, bot):
+    """Deliver a batch of pending notifications from the outbox.
+
+    Delivered offers are marked as notified. Failed deliveries are retried
+    later, subscribers that can't be reached are removed.
+    Returns the amount of handled notifications.
+    """
+    with metrics.time("prepare_notifications"), sentry.span("prepare"):
+        messages, pending, obsolete = await run_sync(prepare_notifications, session)
+    if len(pending) == 0 and len(obsolete) == 0:
+        return 0
+
+    with (
+        metrics.time("dispatch"),
+        sentry.span("send", "send batch", chats=len(messages)),
+    ):
+        statuses = await Dispatcher(bot).dispatch(messages)
+    with metrics.time("record_deliveries"), sentry.span("record"):
+        await run_sync(record_deliveries, session, statuses, pending, obsolete)
+
+    return len(obsolete) + sum(
+        len(keys) for chat_keys in pending.values() for keys in chat_keys
+    )
+
+
+def prepare_notifications(session):
+    """Load a batch of due notifications and build the messages for them.
+
+    Returns the messages by chat id, the keys of the pending notifications
+    by chat id and the keys of obsolete notifications.
+    Pending keys are grouped by the message, which covers their offers.
+    """
+    # Followers have to pick up imported cpu data on their own.
+    # The leader does that in `process_all`, which re-matches all offers.
+    if config["cluster"]["enabled"] and not leader_lock.is_held():
+        cpu_catalog.refresh(session)
+
+    query = (
+        select(Notification)
+        .join(Notification.offer_subscriber)
+        .where(Notification.next_attempt_at <= func.now())
+        .order_by(Notification.id)
+        .limit(config["dispatch"]["batch_size"])
+        .options(
+            contains_eager(Notification.offer_subscriber).joinedload(
+                OfferSubscriber.subscriber
+            ),
+            contains_eager(Notification.offer_subscriber)
+            .joinedload(OfferSubscriber.offer)
+            .selectinload(Offer.offer_disks),
+        )
+    )
+
+    # Each replica only delivers notifications of its own chats.
+    cluster_config = config["cluster"]
+    if cluster_config["enabled"]:
+        partition = func.abs(OfferSubscriber.subscriber_id) % cluster_config["replicas"]
+        query = query.where(partition == cluster_config["replica"])
+
+    notifications = session.scalars(query).all()
+
+    # Notifications of offers that have been sent in the meantime or of
+    # subscribers that are no longer interested are simply dropped.
+    obsolete = []
+    pending = {}
+    for notification in notifications:
+        offer_subscriber = notification.offer_subscriber
+        subscriber = offer_subscriber.subscriber
+        interested = subscriber.active and subscriber.authorized
+        if offer_subscriber.notified or not interested:
+            obsolete.append(notification)
+        else:
+            pending.setdefault(subscriber, []).append(notification)
+
+    messages = {}
+    offer_counts = {}
+    for subscriber, chat_notifications in pending.items():
+        # Offers are sent in the order of their matches.
+        chat_notifications.sort(key=lambda entry: entry.offer_subscriber_id)
+        offer_subscriber = [
+            notification.offer_subscriber for notification in chat_notifications
+        ]
+        messages[subscriber.chat_id], offer_counts[subscriber.chat_id] = (
+            build_offer_messages(session, subscriber, offer_subscriber)
+        )
+
+    # Remember everything that's needed afterwards and don't keep the
+    # transaction open, while waiting for Telegram.
+    def get_keys(notifications):
+        return [
+            (notification.id, notification.version, notification.offer_subscriber_id)
+            for notification in notifications
+        ]
+
+    def group_keys(notifications, counts):
+        keys = get_keys(notifications)
+        groups = []
+        for count in counts:
+            groups.append(keys[:count])
+            keys = keys[count:]
+        return groups
+
+    obsolete = get_keys(obsolete)
+    pending = {
+        subscriber.chat_id: group_keys(
+            chat_notifications, offer_counts[subscriber.chat_id]
+        )
+        for subscriber, chat_notifications in pending.items()
+    }
+    session.commit()
+
+    return messages, pending, obsolete
+
+
+def record_deliveries(session, statuses, pending, obsolete):
+    """Write the outcome of a delivery back to the outbox.
+
+    If a delivery failed midway, the offers of the sent messages are still
+    marked as notified. Only the rest is retried.
+    """
+    delivered = []
+    failed = []
+    for chat_id, (status, sent) in statuses.items():
+        for keys in pending[chat_id][:sent]:
+            delivered += keys
+
+        if status == FAILED:
+            for keys in pending[chat_id][sent:]:
+                failed += keys
+        elif status == UNREACHABLE:
+            # The subscriber might have been removed in the meantime, e.g. via /stop.
+            # Mapper events have to fire, so the percolator index is invalidated.
+            subscriber = session.get(Subscriber, chat_id)
+            if subscriber is not None:
+                session.delete(subscriber)
+
+    # Notifications, whose offer changed during the delivery, have been bumped.
+    # They stay in the outbox and their offers aren't marked as notified.
+    done = [(key[0], key[1]) for key in delivered + obsolete]
+    if len(done) > 0:
+        session.execute(
+            delete(Notification).where(
+                tuple_(Notification.id, Notification.version).in_(done)
+            ),
+            execution_options={"synchronize_session": False},
+        )
+    if len(delivered) > 0:
+        bumped = select(Notification.id).where(
+            Notification.offer_subscriber_id == OfferSubscriber.id
+        )
+        session.execute(
+            update(OfferSubscriber)
+            .where(OfferSubscriber.id.in_([key[2] for key in delivered]))
+            .where(~bumped.exists())
+            .values(notified=True),
+            execution_options={"synchronize_session": False},
+        )
+
+    # Retry failed deliveries with an increasing delay and eventually give up.
+    if len(failed) > 0:
+        failed_ids = [key[0] for key in failed]
+        retry_delay = timedelta(seconds=config["dispatch"]["retry_delay"])
+        session.execute(
+            update(Notification)
+            .where(Notification.id.in_(failed_ids))
+            .values(
+                attempts=Notification.attempts + 1,
+                next_attempt_at=func.now() + retry_delay * (Notification.attempts + 1),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        session.execute(
+            delete(Notification)
+            .where(Notification.id.in_(failed_ids))
+            .where(Notification.attempts >= config["dispatch"]["max_attempts"]),
+            execution_options={"synchronize_session": False},
+        )
+
+    session.commit()
@@ -0,0 +1,39 @@
+"""Run blocking database work without blocking the event loop."""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from hetznerbot.config import config
+
+executor = None
+
+
+def get_executor():
+    """Get the bounded thread pool for database work."""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=config["database"]["thread_count"],
+            thread_name_prefix="database",
+        )
+
+    return executor
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run a blocking function and wait for its result.
+
+    With `database.threaded`, the function is run on the database thread pool.
+    Otherwise it's simply called on the event loop.
+    """
+    if not config["database"]["threaded"]:
+        return func(*args, **kwargs)
+
+    # Keep the context, e.g. for the profiler.
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), partial(context.run, func, *args, **kwargs)
+    )
@@ -0,0 +1,303 @@
+"""Retrieval of the Hetzner server auction feed."""
+
+import codecs
+import hashlib
+import json
+import tempfile
+from json import JSONDecodeError
+
+import httpx
+
+from hetznerbot.config import config
+
+HEADERS = {
+    "Content-Type": "application/json, text/plain, */*",
+    "Referer": "https://www.hetzner.de/sb",
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36"
+        + " (KHTML, like Gecko) Chrome/62.0.3202.75 Safari/537.36"
+    ),
+}
+
+# Downloaded feeds are kept in memory up to this size, larger ones go to disk.
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class FeedReader:
+    """Buffered reader that decodes json values one at a time from a file."""
+
+    def __init__(self, file):
+        """Create a new reader for a binary file."""
+        self.file = file
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk from the file. Returns `False` if nothing is left."""
+        if self.eof:
+            return False
+
+        chunk = self.file.read(CHUNK_SIZE)
+        self.eof = len(chunk) == 0
+        text = self.text_decoder.decode(chunk, final=self.eof)
+
+        # Drop everything that has already been consumed.
+        self.buffer = self.buffer[self.position :] + text
+        self.position = 0
+
+        return not self.eof or len(text) > 0
+
+    def peek(self):
+        """Skip whitespace and return the next character. Empty string on EOF."""
+        while True:
+            while self.position < len(self.buffer):
+                char = self.buffer[self.position]
+                if not char.isspace():
+                    return char
+                self.position += 1
+
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which has to be `char`."""
+        if self.peek() != char:
+            raise JSONDecodeError(f"Expecting '{char}'", self.buffer, self.position)
+        self.position += 1
+
+    def decode(self):
+        """Decode the next json value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.position)
+                # Values at the end of the buffer might be truncated numbers.
+                if end < len(self.buffer) or not self.fill():
+                    self.position = end
+                    return value
+            except JSONDecodeError:
+                if not self.fill():
+                    raise
+
+
+def iter_offers(file):
+    """Incrementally decode the offers of a feed file.
+
+    Only a single offer is decoded at a time, so the memory usage doesn't depend
+    on the size of the feed.
+    """
+    reader = FeedReader(file)
+    reader.expect("{")
+    while reader.peek() != "}":
+        key = reader.decode()
+        reader.expect(":")
+
+        if key != "server":
+            reader.decode()
+            if reader.peek() == ",":
+                reader.expect(",")
+            continue
+
+        reader.expect("[")
+        if reader.peek() == "]":
+            return
+
+        while True:
+            yield reader.decode()
+            if reader.peek() != ",":
+                reader.expect("]")
+                return
+            reader.expect(",")
+
+    raise JSONDecodeError("Feed doesn't contain any servers", reader.buffer, 0)
+
+
+class OfferStream:
+    """The offers of a downloaded feed, which are decoded while iterating.
+
+    The stream can be iterated multiple times, but only once at a time.
+    """
+
+    def __init__(self, file):
+        """Create a new stream from a binary file containing the feed."""
+        self.file = file
+
+    def __iter__(self):
+        """Decode the offers from the start of the feed."""
+        self.file.seek(0)
+        return iter_offers(self.file)
+
+    def close(self):
+        """Close the underlying file."""
+        self.file.close()
+
+
+def dump_offer(offer):
+    """Serialize a decoded offer in a canonical way.
+
+    Keys are sorted, so the result doesn't depend on the key order of the feed.
+    """
+    return json.dumps(offer, sort_keys=True, separators=(",", ":"))
+
+
+class HetznerFeed:
+    """Async client for the live server auction feed.
+
+    The underlying http client is created lazily and kept around between polls.
+    That way the connection pool (and with it the TLS connection to Hetzner)
+    is reused by every cycle of the processing job.
+    """
+
+    client = None
+
+    # Validators and payload digest of the last feed that has been processed.
+    etag = None
+    last_modified = None
+    digest = None
+
+    # Validators and digest of the last fetched feed.
+    # They only replace the ones above once the feed has been processed,
+    # so a failing cycle doesn't cause the next one to skip the same feed.
+    pending = None
+
+    # Whether the last fetch returned the same feed that has already been processed.
+    unchanged = False
+
+    # The offers of the last fetched feed.
+    stream = None
+
+    def get_client(self):
+        """Get the pooled http client. Create it if it doesn't exist yet."""
+        if self.client is None or self.client.is_closed:
+            hetzner_config = config["hetzner"]
+            self.client = httpx.AsyncClient(
+                headers=HEADERS,
+                timeout=httpx.Timeout(
+                    hetzner_config["read_timeout"],
+                    connect=hetzner_config["connect_timeout"],
+                ),
+                limits=httpx.Limits(
+                    max_connections=2,
+                    max_keepalive_connections=1,
+                    keepalive_expiry=hetzner_config["keepalive_expiry"],
+                ),
+            )
+
+        return self.client
+
+    async def close(self):
+        """Close the http client and all pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def fetch(self, conditional=False):
+        """Get the newest hetzner offers.
+
+        The feed is downloaded into a spooled temporary file and returned as an
+        `OfferStream`, which decodes one offer at a time.
+        The stream stays valid until the next fetch.
+
+        Returns `None`, if the feed couldn't be retrieved. The feed is only
+        decoded by the consumer of the stream, which has to handle decoding errors.
+
+        If `conditional` is set, the feed is requested with the validators of
+        the last processed feed and compared to it. If nothing changed,
+        `unchanged` is set and `None` is returned as well.
+
+        The comparison uses a digest of the raw payload, not of the decoded
+        offers. Feeds that only differ in formatting, key order or fields
+        other than `server` aren't skipped. They're diffed against the offer
+        snapshot instead, which finds no changes, so nothing is written or matched.
+        """
+        self.unchanged = False
+        self.pending = None
+
+        headers = {}
+        if conditional:
+            if self.etag is not None:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified is not None:
+                headers["If-Modified-Since"] = self.last_modified
+
+        # Get rid of the previous feed
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        client = self.get_client()
+        file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        # Hash the raw payload while downloading, so the feed isn't decoded here.
+        # A digest of the decoded offers would need an additional decoding pass.
+        digest = hashlib.sha256()
+        try:
+            request = client.build_request(
+                "GET", config["hetzner"]["url"], headers=headers
+            )
+            response = await client.send(request, stream=True)
+            try:
+                if response.status_code == httpx.codes.NOT_MODIFIED:
+                    self.unchanged = True
+                    file.close()
+                    return None
+
+                response.raise_for_status()
+
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    digest.update(chunk)
+                    file.write(chunk)
+            finally:
+                await response.aclose()
+        except httpx.TimeoutException:
+            print("Timeout while retrieving data.")
+            file.close()
+            return None
+        except httpx.HTTPStatusError as e:
+            print(f"Got status {e.response.status_code} while retrieving data.")
+            file.close()
+            return None
+        except httpx.TransportError:
+            print("Connection error while retrieving data.")
+            file.close()
+            return None
+
+        offers = OfferStream(file)
+        self.pending = (
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            digest.hexdigest(),
+        )
+
+        # The server doesn't always honor our validators.
+        # Compare the actual payload as well.
+        if conditional and self.pending[2] == self.digest:
+            self.unchanged = True
+            self.mark_processed()
+            offers.close()
+            return None
+
+        self.stream = offers
+        return offers
+
+    def reset(self):
+        """Forget the last processed feed. The next fetch won't be skipped."""
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+        self.pending = None
+        self.unchanged = False
+
+    def mark_processed(self):
+        """Remember the last fetched feed as successfully processed."""
+        if self.pending is None:
+            return
+
+        self.etag, self.last_modified, self.digest = self.pending
+        self.pending = None
+
+
+hetzner_feed = HetznerFeed()
@@ -1,182 +1,314 @@
 """Hetzner helper functions."""
 
-import json
+import asyncio
 from datetime import datetime
-from json import JSONDecodeError
+from functools import partial
+from itertools import islice
 
 import telegram
-from requests import request
-from requests.exceptions import ConnectionError
-from sqlalchemy import and_, func, select, update
+from sqlalchemy import delete, func, or_, select, update
 
 from hetznerbot.config import config
+from hetznerbot.helper.cpu import CpuStats, cpu_catalog
+from hetznerbot.helper.diff import (
+    OFFER_VERSION,
+    get_disk_stats,
+    load_records,
+    normalize_offer,
+    offer_snapshot,
+)
 from hetznerbot.helper.disk_type import DiskType
-from hetznerbot.helper.text import split_text
-from hetznerbot.models import Cpu, Offer, OfferDisk, OfferSubscriber, Subscriber
+from hetznerbot.helper.executor import run_sync
+from hetznerbot.helper.feed import hetzner_feed
+from hetznerbot.helper.history import record_history
+from hetznerbot.helper.matching import find_matches, reconcile_matches
+from hetznerbot.helper.metrics import metrics
+from hetznerbot.helper.offer_event import OfferEvent
+from hetznerbot.helper.outbox import enqueue_notifications
+from hetznerbot.helper.percolator import percolator
+from hetznerbot.helper.render import render_cache
+from hetznerbot.helper.snapshot import snapshot_recorder
+from hetznerbot.helper.text import split_lines, split_text
+from hetznerbot.helper.vectorized import get_vectorized_matcher
+from hetznerbot.models import (
+    Notification,
+    Offer,
+    OfferDisk,
+    OfferSubscriber,
+    Subscriber,
+    VersionStamp,
+)
 from hetznerbot.sentry import sentry
 
+# The amount of incoming offers that are kept in the session at the same time.
+BATCH_SIZE = 500
 
-def get_hetzner_offers():
-    """Get the newest hetzner offers."""
-    headers = {
-        "Content-Type": "application/json, text/plain, */*",
-        "Referer": "https://www.hetzner.de/sb",
-        "User-Agent": (
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36"
-            + " (KHTML, like Gecko) Chrome/62.0.3202.75 Safari/537.36"
-        ),
-    }
-
-    url = "https://www.hetzner.com/_resources/app/data/app/live_data_sb_EUR.json"
-    try:
-        response = request("GET", url, headers=headers)
-        data = json.loads(response.content)
-        return data["server"]
-    except ConnectionError:
-        print("Connection error while retrieving data.")
-        return None
-    except (JSONDecodeError, UnicodeDecodeError):
-        print("Failed to decode json.")
-        sentry.capture_exception()
-        return None
-
-
-def populate_disk_data(
-    offer_id: int, disks: list[OfferDisk], disk_type: DiskType, disk_size_entry: int
-):
-    """Set disk data and handle multiple disk types.
-
-    Either increments the disk count of an existing member of `disks`
-    or creates a new entry in it.
-    """
-    # skip general, it just repeats the info of other more specific categories.
-    if disk_type == "general":
-        return
 
-    # go through every disk entry
-    for disk in disks:
-        # if there's already a disk in the list that matches the current
-        # specifications, increment the count.
-        if disk.type == disk_type and disk.size == disk_size_entry:
-            disk.amount += 1
-            return
+async def get_hetzner_offers(conditional=False):
+    """Get the newest hetzner offers.
+
+    Conditional fetches return `None` if the feed didn't change since the last
+    processed fetch. Check `hetzner_feed.unchanged` to distinguish this from errors.
+    """
+    offers = await hetzner_feed.fetch(conditional=conditional)
+    if offers is not None:
+        # Recording decodes and compresses the feed, keep that off the event loop.
+        await asyncio.to_thread(snapshot_recorder.record, offers)
 
-    # if none of the existing disks matched, we create a new one.
-    disks.append(OfferDisk(offer_id, disk_type, disk_size_entry))
+    return offers
 
 
 def update_offers(session, incoming_offers):
-    """Update all offers and check for updates."""
-    active_ids = []
-    offers = []
+    """Update all offers and check for updates.
+
+    `incoming_offers` may be a lazily decoded stream of offers.
+    The offers are normalized and compared to the snapshot of the last processed
+    feed. Only added and changed offers are written to the database.
+    If there's no snapshot yet, all offers are written.
+
+    Offers are processed in batches, which are flushed and evicted from the
+    session afterwards. That way only a single batch of ORM objects is kept in
+    memory. All existing offers of a batch are loaded at once, disks and
+    subscriptions are updated with set-based statements.
+    Added, changed and removed offers are appended to the offer history.
 
-    for incoming_offer in incoming_offers:
-        active_ids.append(incoming_offer["key"])
-        offer = session.get(Offer, incoming_offer["key"])
+    Returns the `OfferDiff`. Once it has been fully processed, it has to be applied
+    to the `offer_snapshot`.
+    """
+    diff = offer_snapshot.diff(normalize_offer(offer) for offer in incoming_offers)
+    cpus = cpu_catalog.get_cpus(session)
 
-        if not offer:
-            offer = Offer(incoming_offer["key"])
-            session.add(offer)
-            offer.first_seen_at = datetime.now()
+    records = iter(diff.get_changed_records())
+    while batch := list(islice(records, BATCH_SIZE)):
+        keys = [record["key"] for record in batch]
 
-        offer.cpu = incoming_offer["cpu"].strip()
-        offer.ram = incoming_offer["ram_size"]
-        offer.datacenter = incoming_offer["datacenter"]
+        # Load all existing offers of this batch.
+        query = select(Offer).where(Offer.id.in_(keys))
+        offers = {offer.id: offer for offer in session.scalars(query)}
 
-        # Generate disk data
+        price_changed_ids = []
+        disk_changed_ids = []
         new_disks = []
-        for disk_type in incoming_offer["serverDiskData"]:
-            # skip general, it just repeats the info of other more specific categories.
-            if disk_type == "general":
-                continue
-
-            disk_array = incoming_offer["serverDiskData"][disk_type]
-            for disk_size_entry in disk_array:
-                populate_disk_data(
-                    offer.id, new_disks, DiskType[disk_type], disk_size_entry
-                )
+        added = []
+        changed = []
+        for record in batch:
+            offer = offers.get(record["key"])
+            # Offers that re-appear after they've been removed count as added.
+            is_added = offer is None or offer.deactivated
+            if is_added:
+                added.append((record["key"], record["price"]))
+
+            if offer is None:
+                offer = Offer(record["key"])
+                session.add(offer)
+                offer.first_seen_at = datetime.now()
+                offers[offer.id] = offer
+
+            # Disks are only touched if their signature changed.
+            if offer.disk_signature != record["disk_signature"]:
+                disk_changed_ids.append(offer.id)
+                new_disks += get_offer_disks(offer.id, record)
+
+            if update_offer(offer, record, cpus.get(record["cpu"])):
+                price_changed_ids.append(offer.id)
+                # A re-listing is recorded once, as added.
+                if not is_added:
+                    changed.append((offer.id, record["price"]))
+
+        # Replace the disks of all offers, whose disks changed.
+        if len(disk_changed_ids) > 0:
+            session.execute(
+                delete(OfferDisk).where(OfferDisk.offer_id.in_(disk_changed_ids))
+            )
+            session.add_all(new_disks)
+
+        # Notify all subscribers about the price changes.
+        # Mark the offers as "not new".
+        if len(price_changed_ids) > 0:
+            session.execute(
+                update(OfferSubscriber)
+                .where(OfferSubscriber.offer_id.in_(price_changed_ids))
+                .values(notified=False, new=False)
+            )
+            enqueue_notifications(session, offer_ids=price_changed_ids, changed=True)
 
-        # Create two sets, representing the old disk pool and the new disk pool.
-        old_disks_set = set(
-            [
-                f"{disks.type.name}-{disks.size}-{disks.amount}"
-                for disks in offer.offer_disks
-            ]
-        )
-        new_disks_set = set(
-            [f"{disks.type.name}-{disks.size}-{disks.amount}" for disks in new_disks]
-        )
+        record_history(session, OfferEvent.added, added)
+        record_history(session, OfferEvent.changed, changed)
 
-        # Check if the set of disks changed. If that's the case, update the disks
-        if old_disks_set != new_disks_set:
-            # clear out existing disk data
-            for offer_disk in offer.offer_disks:
-                session.delete(offer_disk)
-            offer.offer_disks.clear()
-
-            # add new disks to the offer
-            for disk in new_disks:
-                offer.offer_disks.append(disk)
-
-        # Check for specials on this offer.
-        offer.ecc = incoming_offer["is_ecc"]
-        offer.ipv4 = "IPv4" in incoming_offer["specials"]
-        offer.inic = "iNIC" in incoming_offer["specials"]
-        offer.hwr = "HWR" in incoming_offer["specials"]
-
-        # Calculate the price in cents
-        price = incoming_offer["price"] * 100
-        if offer.ipv4:
-            # Ipv4 is an extra 1.70€
-            price += 170
-
-        # Notify all subscribers about the price change
-        if offer.price is not None and offer.price != price:
-            offer.last_update = datetime.now()
-            # Mark the offer as "not new"
-            for subscription in offer.offer_subscriber:
-                subscription.notified = False
-                subscription.new = False
-
-        offer.price = price
-
-        offer.deactivated = False
-        offers.append(offer)
+        session.flush()
+        session.expunge_all()
 
     # Deactivate all old offers
-    session.execute(
-        update(Offer)
-        .where(Offer.deactivated.is_(False))
-        .where(Offer.id.notin_(active_ids))
-        .values(deactivated=True),
-    )
+    query = update(Offer).where(Offer.deactivated.is_(False))
+    if diff.full:
+        query = query.where(Offer.id.notin_(diff.records.keys()))
+    else:
+        query = query.where(Offer.id.in_(diff.removed))
+    if diff.full or len(diff.removed) > 0:
+        removed = session.execute(
+            query.values(deactivated=True).returning(Offer.id, Offer.price)
+        )
+        record_history(session, OfferEvent.removed, removed.all())
+
+        # Drop all matches of deactivated offers at once.
+        if diff.full:
+            deactivated_ids = select(Offer.id).where(Offer.deactivated.is_(True))
+        else:
+            deactivated_ids = diff.removed
+        result = session.execute(
+            delete(OfferSubscriber).where(OfferSubscriber.offer_id.in_(deactivated_ids))
+        )
+        metrics.count_matches(removed=result.rowcount)
 
+    # Let other replicas know that their in-memory offers are outdated.
+    if not diff.is_empty():
+        VersionStamp.bump(session, OFFER_VERSION)
     session.commit()
 
-    return offers
+    # Formatted versions of changed and deactivated offers are outdated.
+    offer_ids = diff.get_offer_ids()
+    if offer_ids is None:
+        render_cache.clear()
+    else:
+        render_cache.evict(offer_ids | set(diff.removed))
+
+    return diff
+
+
+def get_offer_disks(offer_id, record):
+    """Create the disks of a normalized offer record."""
+    disks = []
+    for disk_type, size, amount in record["disks"]:
+        disk = OfferDisk(offer_id, DiskType[disk_type], size)
+        disk.amount = amount
+        disks.append(disk)
+
+    return disks
+
+
+def update_offer(offer, record, cpu):
+    """Update the attributes of a single offer from a normalized record.
+
+    `cpu` are the stats of the offer's cpu or `None`, if it's unknown.
+    Returns whether the price of an existing offer changed.
+    """
+    offer.cpu = record["cpu"]
+    offer.ram = record["ram"]
+    offer.datacenter = record["datacenter"]
+    offer.disk_signature = record["disk_signature"]
+
+    # Derived columns, which are used for matching.
+    for name, value in get_disk_stats(record["disks"]).items():
+        setattr(offer, name, value)
+
+    if cpu is None:
+        cpu = CpuStats(None, None, None, None)
+    offer.cpu_threads = cpu.threads
+    offer.cpu_release_date = cpu.release_date
+    offer.cpu_multi_rating = cpu.multi_thread_rating
+    offer.cpu_single_rating = cpu.single_thread_rating
+
+    # Specials on this offer.
+    offer.ecc = record["ecc"]
+    offer.ipv4 = record["ipv4"]
+    offer.inic = record["inic"]
+    offer.hwr = record["hwr"]
+
+    price_changed = offer.price is not None and offer.price != record["price"]
+    if price_changed:
+        offer.last_update = datetime.now()
+
+    offer.price = record["price"]
+    offer.deactivated = False
+
+    return price_changed
 
 
 def check_all_offers_for_subscriber(session, subscriber):
     """Check all offers for a specific subscriber."""
-    check_offer_for_subscriber(session, subscriber)
+    subscriber_ids = [subscriber.chat_id]
 
+    mode = config["matching"]["mode"]
+    if mode == "vectorized":
+        matches = get_vectorized_matcher().find_matches(
+            session, subscriber_ids=subscriber_ids
+        )
+    elif mode in ["set", "percolator"]:
+        # The percolator routes offers to subscribers. For the opposite
+        # direction, the set-based query is used.
+        matches = find_matches(session, subscriber_ids=subscriber_ids)
+    else:
+        matches = {
+            (offer_id, subscriber.chat_id)
+            for offer_id in find_offers_for_subscriber(session, subscriber)
+        }
 
-def check_offers_for_subscribers(session):
-    """Check for each offer if any subscriber are interested in it."""
-    query = (
-        select(Subscriber)
-        .filter(Subscriber.authorized.is_(True))
-        .filter(Subscriber.active.is_(True))
-    )
+    reconcile_matches(session, matches, subscriber_ids=subscriber_ids)
+    session.commit()
+
+
+def check_offers_for_subscribers(session, diff=None):
+    """Check for each offer if any subscriber are interested in it.
+
+    If an `OfferDiff` is given, only its added and changed offers are checked.
+    Matches of removed offers have already been dropped by `update_offers`.
+    """
+    offer_ids = diff.get_offer_ids() if diff is not None else None
+
+    mode = config["matching"]["mode"]
+    # The in-memory columns have to follow every diff, even if only offers
+    # have been removed.
+    if mode == "vectorized":
+        get_vectorized_matcher().update(session, diff)
 
-    subscribers = session.scalars(query).all()
-    for subscriber in subscribers:
-        check_offer_for_subscriber(session, subscriber)
+    if offer_ids is not None and len(offer_ids) == 0:
+        return
 
+    if mode == "set":
+        # Match all subscribers with a single query.
+        matches = find_matches(session, offer_ids=offer_ids)
+    elif mode == "percolator":
+        # Route the offers to their subscribers via the subscriber index.
+        if diff is None:
+            records = load_records(session).values()
+        elif offer_ids is None:
+            records = diff.records.values()
+        else:
+            records = diff.get_changed_records()
 
-def check_offer_for_subscriber(session, subscriber):
-    """Check the offers for a specific subscriber."""
+        cpus = cpu_catalog.get_cpus(session)
+        matches = percolator.find_matches(session, records, cpus)
+    elif mode == "vectorized":
+        # Match all subscribers against the in-memory offer columns.
+        matches = get_vectorized_matcher().find_matches(session, offer_ids=offer_ids)
+    else:
+        query = (
+            select(Subscriber)
+            .filter(Subscriber.authorized.is_(True))
+            .filter(Subscriber.active.is_(True))
+        )
+
+        matches = set()
+        for subscriber in session.scalars(query).all():
+            with sentry.span("match.subscriber", subscriber=subscriber.chat_id):
+                offer_ids_of_subscriber = find_offers_for_subscriber(
+                    session, subscriber, offer_ids
+                )
+            for offer_id in offer_ids_of_subscriber:
+                matches.add((offer_id, subscriber.chat_id))
+
+    # Write all matches at once and commit them in a single transaction.
+    reconcile_matches(session, matches, offer_ids=offer_ids)
+    session.commit()
+
+
+def find_offers_for_subscriber(session, subscriber, offer_ids=None):
+    """Get the ids of all offers that match a specific subscriber.
+
+    If `offer_ids` are given, only those offers are checked.
+    """
     # Sum disk counts across all disk groups where each disk is large enough.
+    # That's only necessary, if some disks of an offer are too small.
     disk_count_subq = (
         select(func.sum(OfferDisk.amount))
         .where(OfferDisk.offer_id == Offer.id)
@@ -186,41 +318,29 @@ def check_offer_for_subscriber(session, subscriber):
     )
 
     query = (
-        select(Offer)
+        select(Offer.id)
         .filter(Offer.deactivated.is_(False))
         .filter(Offer.price <= subscriber.price * 100)
         .filter(Offer.ram >= subscriber.ram)
-        .filter(disk_count_subq >= subscriber.hdd_count)
+        .filter(Offer.largest_disk_size >= subscriber.hdd_size)
+        .filter(Offer.disk_count >= subscriber.hdd_count)
         .filter(
-            Offer.cpu.in_(
-                session.query(Cpu.name)
-                .filter(Cpu.threads >= subscriber.threads)
-                .filter(Cpu.release_date >= subscriber.release_date)
-                .filter(Cpu.multi_thread_rating >= subscriber.multi_rating)
-                .filter(Cpu.single_thread_rating >= subscriber.single_rating)
+            or_(
+                Offer.smallest_disk_size >= subscriber.hdd_size,
+                disk_count_subq >= subscriber.hdd_count,
             )
         )
+        .filter(Offer.cpu_threads >= subscriber.threads)
+        .filter(Offer.cpu_release_date >= subscriber.release_date)
+        .filter(Offer.cpu_multi_rating >= subscriber.multi_rating)
+        .filter(Offer.cpu_single_rating >= subscriber.single_rating)
     )
 
     # Calculate after_raid
     if subscriber.raid == "raid5":
-        query = query.filter(
-            Offer.offer_disks.any(
-                and_(
-                    OfferDisk.amount >= 3,
-                    (OfferDisk.amount - 1) * OfferDisk.size >= subscriber.after_raid,
-                )
-            )
-        )
+        query = query.filter(Offer.raid5_capacity >= subscriber.after_raid)
     elif subscriber.raid == "raid6":
-        query = query.filter(
-            Offer.offer_disks.any(
-                and_(
-                    OfferDisk.amount >= 4,
-                    (OfferDisk.amount - 2) * OfferDisk.size >= subscriber.after_raid,
-                )
-            )
-        )
+        query = query.filter(Offer.raid6_capacity >= subscriber.after_raid)
 
     if subscriber.datacenter is not None:
         query = query.filter(Offer.datacenter.startswith(subscriber.datacenter))
@@ -237,42 +357,28 @@ def check_offer_for_subscriber(session, subscriber):
     if subscriber.hwr:
         query = query.filter(Offer.hwr.is_(True))
 
-    matching_offers = session.scalars(query).all()
-    for offer in matching_offers:
-        # Check if there's already a relation relation.
-        exists = list(
-            filter(lambda o: o.offer_id == offer.id, subscriber.offer_subscriber)
-        )
-
-        # If not, create a new OfferSubscriber entity.
-        if len(exists) == 0:
-            offer_subscriber = OfferSubscriber(offer.id, subscriber.chat_id)
-            subscriber.offer_subscriber.append(offer_subscriber)
-
-            session.add(offer_subscriber)
-            session.commit()
+    if offer_ids is not None:
+        query = query.filter(Offer.id.in_(offer_ids))
 
-    # Clean old entries
-    for offer_subscriber in subscriber.offer_subscriber:
-        if offer_subscriber.offer not in matching_offers:
-            session.delete(offer_subscriber)
+    return set(session.scalars(query))
 
-    session.commit()
 
+async def notify_about_new_cpu(context, session, records):
+    """Check for any cpu for which no stats are present. If so, let the admin know.
 
-async def notify_about_new_cpu(context, session):
-    """Check for any cpu for which no stats are present. If so, let the admin know."""
-    query = select(Offer).distinct().filter(Offer.cpu.notin_(session.query(Cpu.name)))
-    offers_with_new_cpus = session.scalars(query).all()
+    `records` are the normalized records of all active offers.
+    """
+    cpus = await run_sync(cpu_catalog.get_cpus, session)
+    offers_with_new_cpus = [record for record in records if record["cpu"] not in cpus]
 
     # Remove all cpus from the list for which we've already been notified
     if "new_cpus" not in context.bot_data:
         context.bot_data["new_cpus"] = []
 
     not_yet_notified = []
-    for offer in offers_with_new_cpus:
-        if offer.cpu not in context.bot_data["new_cpus"]:
-            not_yet_notified.append(offer)
+    for record in offers_with_new_cpus:
+        if record["cpu"] not in context.bot_data["new_cpus"]:
+            not_yet_notified.append(record)
 
     # Early return if there's nothing to do
     if len(not_yet_notified) == 0:
@@ -280,9 +386,9 @@ async def notify_about_new_cpu(context, session):
 
     # Build notification message
     info = "Please add info about these cpus:\n"
-    for offer in not_yet_notified:
-        info += f"'{offer.cpu} (offer: {offer.id})'\n"
-        context.bot_data["new_cpus"].append(offer.cpu)
+    for record in not_yet_notified:
+        info += f"'{record['cpu']} (offer: {record['key']})'\n"
+        context.bot_data["new_cpus"].append(record["cpu"])
 
     await context.bot.sendMessage(
         chat_id=config["telegram"]["admin_id"],
@@ -290,108 +396,146 @@ async def notify_about_new_cpu(context, session):
     )
 
 
-def format_offers(session, subscriber, offer_subscriber, get_all=False):
+def format_offers(session, subscriber, offer_subscriber):
     """Format the found offers."""
-    # Filter all offers, which aren't notified yet, if the user doesn't want all offers.
-    if not get_all:
-        offer_subscriber = list(filter(lambda o: not o.notified, offer_subscriber))
-
     if len(offer_subscriber) == 0:
         return []
 
+    return split_text(render_offers(session, subscriber, offer_subscriber))
+
+
+def render_offers(session, subscriber, offer_subscriber):
+    """Format each of the found offers.
+
+    Offers are formatted once for each variant and shared between subscribers.
+    """
+
+    # Only these raid modes change the formatted offer.
+    raid = subscriber.raid if subscriber.raid in ["raid5", "raid6"] else None
+    # Make sure the cpu catalog is loaded, as its version is part of the offer version.
+    cpu_catalog.get_cpus(session)
+
     formatted_offers = []
-    for _, offer_subscriber in enumerate(offer_subscriber):
-        # The subscriber should only receive new offers
-        offer_subscriber.notified = True
+    for offer_subscriber in offer_subscriber:
         offer = offer_subscriber.offer
-
-        # Whether this is a new entry or a price reduction occured.
-        if offer_subscriber.new:
-            offer_status = "(*New*)"
-        else:
-            offer_status = "(*Price reduction*)"
-
-        # Format extra features
-        extra_features = ""
-        if offer.ipv4:
-            extra_features += "IPv4 "
-        if offer.inic:
-            extra_features += "iNIC "
-        if offer.hwr:
-            extra_features += "HWR "
-        if extra_features == "":
-            extra_features = "None"
-
-        # Calculate the price including VAT.
-        price = offer.price / 100
-        price_incl_vat = float(offer.price) * 1.19 / 100
-
-        # First chunk of data
-        updated_date = offer.last_update.strftime("%d.%m - %H:%M")
-        url = f"https://www.hetzner.com/de/sb/#search={offer.id}"
-        formatted_offer = (
-            f"""*Offer* [{offer.id}]({url}) {offer_status}: [ {updated_date} ]"""
+        variant = (raid, offer_subscriber.new)
+        render = partial(format_offer, session, offer, raid, offer_subscriber.new)
+        formatted_offers.append(
+            render_cache.get(offer.id, get_render_version(offer), variant, render)
         )
 
-        # Add cpu info, if possible
-        cpu = session.get(Cpu, offer.cpu)
-        if cpu is None:
-            formatted_offer += f"\n_Cpu:_ {offer.cpu}"
-        else:
-            formatted_offer += f"""\n_Cpu:_ {cpu.name} ({cpu.release_date})
-    - *{cpu.threads}* threads
-    - Multi: *{cpu.multi_thread_rating}*
-    - Single: *{cpu.single_thread_rating}*"""
-
-        # Add ram
-        formatted_offer += f"\n_Ram:_ *{offer.ram} GB*"
-        if offer.ecc:
-            formatted_offer += " (ECC)"
-
-        # Add disk and raid info
-        formatted_offer += "\n_Disks:_"
-        # Get info on disk sizes
-        biggest_raid_5_pool = None
-        biggest_raid_6_pool = None
-        for offer_disk in offer.offer_disks:
-            formatted_offer += (
-                f"\n    - {offer_disk.amount}x "
-                + f"*{format_size(offer_disk.size)}* "
-                + f"{get_disk_type_name(offer_disk.type)}"
-            )
-            if offer_disk.amount >= 3:
-                raid_5_pool = offer_disk.size * (offer_disk.amount - 1)
-                if not biggest_raid_5_pool or raid_5_pool > biggest_raid_5_pool:
-                    biggest_raid_5_pool = raid_5_pool
-
-            if offer_disk.amount >= 4:
-                raid_6_pool = offer_disk.size * (offer_disk.amount - 2)
-                if not biggest_raid_6_pool or raid_6_pool > biggest_raid_6_pool:
-                    biggest_raid_6_pool = raid_6_pool
-
-        if subscriber.raid == "raid5":
-            pool_string = (
-                f"{format_size(biggest_raid_5_pool)}" if biggest_raid_5_pool else "n/a"
-            )
-            formatted_offer += f"\n_Raid5 capacity:_ *{pool_string}*"
-        elif subscriber.raid == "raid6":
-            pool_string = (
-                f"{format_size(biggest_raid_6_pool)}" if biggest_raid_6_pool else "n/a"
-            )
-            formatted_offer += f"\n_Raid6 capacity:_ *{pool_string}*"
+    return formatted_offers
+
 
-        # Remaining chunk of data
-        formatted_offer += f"""
-_Extra features:_ *{extra_features}*
-_Price:_ {price:.2f}€ (VAT incl.: {price_incl_vat:.2f})
-_Datacenter:_ {offer.datacenter}
-        """
+def get_render_version(offer):
+    """Get everything that the formatted offer depends on.
 
-        formatted_offers.append(formatted_offer)
+    Offers may be changed by other replicas, so this doesn't rely on eviction.
+    """
+    return (
+        offer.last_update,
+        offer.price,
+        offer.cpu,
+        offer.ram,
+        offer.datacenter,
+        offer.disk_signature,
+        offer.ecc,
+        offer.ipv4,
+        offer.inic,
+        offer.hwr,
+        cpu_catalog.version,
+    )
 
-    formatted_offers = split_text(formatted_offers, max_chunks=5)
 
-    return formatted_offers
+def format_offer(session, offer, raid, new):
+    """Format a single offer for subscribers with the given raid mode."""
+    # Whether this is a new entry or a price reduction occured.
+    if new:
+        offer_status = "(*New*)"
+    else:
+        offer_status = "(*Price reduction*)"
+
+    # Format extra features
+    extra_features = ""
+    if offer.ipv4:
+        extra_features += "IPv4 "
+    if offer.inic:
+        extra_features += "iNIC "
+    if offer.hwr:
+        extra_features += "HWR "
+    if extra_features == "":
+        extra_features = "None"
+
+    # Calculate the price including VAT.
+    price = offer.price / 100
+    price_incl_vat = float(offer.price) * 1.19 / 100
+
+    # First chunk of data
+    updated_date = offer.last_update.strftime("%d.%m - %H:%M")
+    url = f"https://www.hetzner.com/de/sb/#search={offer.id}"
+    formatted_offer = (
+        f"""*Offer* [{offer.id}]({url}) {offer_status}: [ {updated_date} ]"""
+    )
+
+    # Add cpu info, if possible
+    cpu = cpu_catalog.get_cpus(session).get(offer.cpu)
+    if cpu is None:
+        formatted_offer += f"\n_Cpu:_ {offer.cpu}"
+    else:
+        formatted_offer += (
+            f"\n_Cpu:_ {offer.cpu} ({cpu.release_date})"
+            + f"\n    - *{cpu.threads}* threads"
+            + f"\n    - Multi: *{cpu.multi_thread_rating}*"
+            + f"\n    - Single: *{cpu.single_thread_rating}*"
+        )
+
+    # Add ram
+    formatted_offer += f"\n_Ram:_ *{offer.ram} GB*"
+    if offer.ecc:
+        formatted_offer += " (ECC)"
+
+    # Add disk and raid info
+    formatted_offer += "\n_Disks:_"
+    # Get info on disk sizes
+    biggest_raid_5_pool = None
+    biggest_raid_6_pool = None
+    for offer_disk in offer.offer_disks:
+        formatted_offer += (
+            f"\n    - {offer_disk.amount}x "
+            + f"*{format_size(offer_disk.size)}* "
+            + f"{get_disk_type_name(offer_disk.type)}"
+        )
+        if offer_disk.amount >= 3:
+            raid_5_pool = offer_disk.size * (offer_disk.amount - 1)
+            if not biggest_raid_5_pool or raid_5_pool > biggest_raid_5_pool:
+                biggest_raid_5_pool = raid_5_pool
+
+        if offer_disk.amount >= 4:
+            raid_6_pool = offer_disk.size * (offer_disk.amount - 2)
+            if not biggest_raid_6_pool or raid_6_pool > biggest_raid_6_pool:
+                biggest_raid_6_pool = raid_6_pool
+
+    if raid == "raid5":
+        pool_string = (
+            f"{format_size(biggest_raid_5_pool)}" if biggest_raid_5_pool else "n/a"
+        )
+        formatted_offer += f"\n_Raid5 capacity:_ *{pool_string}*"
+    elif raid == "raid6":
+        pool_string = (
+            f"{format_size(biggest_raid_6_pool)}" if biggest_raid_6_pool else "n/a"
+        )
+        formatted_offer += f"\n_Raid6 capacity:_ *{pool_string}*"
+
+    # Remaining chunk of data
+    formatted_offer += (
+        f"\n_Extra features:_ *{extra_features}*"
+        + f"\n_Price:_ {price:.2f}€ (VAT incl.: {price_incl_vat:.2f})"
+        + f"\n_Datacenter:_ {offer.datacenter}"
+        # Keep the trailing whitespace of the original template.
+        + "\n        "
+    )
+
+    return formatted_offer
 
 
 def get_disk_type_name(disk_type: DiskType) -> str:
@@ -410,36 +554,94 @@ def format_size(disk_size: int) -> str:
         return f"{disk_size / 1000} TB"
 
 
-async def send_offers(bot, subscriber, session, get_all=False):
-    """Send the newest update to all subscribers."""
-    # Extract message meta data
-    formatted_offers = format_offers(
-        session, subscriber, subscriber.offer_subscriber, get_all=get_all
-    )
+def get_offer_messages(session, subscriber, get_all=False):
+    """Get all messages with the newest offers for a subscriber.
 
-    if len(formatted_offers) > 0:
-        for chunk in formatted_offers:
-            try:
-                await bot.sendMessage(
-                    chat_id=subscriber.chat_id,
-                    text=chunk,
-                    parse_mode="Markdown",
-                    disable_web_page_preview=True,
+    The offers are marked as notified and their notifications are removed from
+    the outbox. Each message is a dict with the keyword arguments for
+    `bot.send_message`.
+    """
+    offer_subscriber = subscriber.offer_subscriber
+    # Filter all offers, which aren't notified yet, if the user doesn't want all offers.
+    if not get_all:
+        offer_subscriber = list(filter(lambda o: not o.notified, offer_subscriber))
+
+    # The subscriber should only receive new offers
+    for entry in offer_subscriber:
+        entry.notified = True
+
+    # The offers are sent right away, the delivery job mustn't send them again.
+    if len(offer_subscriber) > 0:
+        session.execute(
+            delete(Notification).where(
+                Notification.offer_subscriber_id.in_(
+                    [entry.id for entry in offer_subscriber]
                 )
-            except telegram.error.Forbidden:
-                session.delete(subscriber)
-                session.commit()
-
-        if len(formatted_offers) >= 5:
-            await bot.sendMessage(
-                chat_id=subscriber.chat_id,
-                text="Too many results, please narrow down your search a little.",
             )
+        )
+
+    messages, _ = build_offer_messages(session, subscriber, offer_subscriber, get_all)
+    return messages
+
+
+def build_offer_messages(session, subscriber, offer_subscriber, get_all=False):
+    """Get the messages for some offers of a subscriber.
+
+    Returns the messages and the amount of offers each message covers.
+    Offers that don't fit into the messages are covered by the last one.
+    """
+    chunks = []
+    if len(offer_subscriber) > 0:
+        chunks = split_lines(render_offers(session, subscriber, offer_subscriber))
+
+    messages = [
+        {
+            "chat_id": subscriber.chat_id,
+            "text": "\n\n".join(chunk),
+            "parse_mode": "Markdown",
+            "disable_web_page_preview": True,
+        }
+        for chunk in chunks
+    ]
+    offer_counts = [len(chunk) for chunk in chunks]
+
+    if len(chunks) >= 5:
+        messages.append(
+            {
+                "chat_id": subscriber.chat_id,
+                "text": "Too many results, please narrow down your search a little.",
+            }
+        )
+        offer_counts.append(len(offer_subscriber) - sum(offer_counts))
+    elif len(chunks) == 0 and get_all:
+        messages.append(
+            {
+                "chat_id": subscriber.chat_id,
+                "parse_mode": "Markdown",
+                "text": "There are currently no offers for your criteria.",
+            }
+        )
+        offer_counts.append(0)
+
+    return messages, offer_counts
+
+
+async def send_offers(bot, subscriber, session, get_all=False):
+    """Send the newest update to a single subscriber."""
+    messages = await run_sync(get_offer_messages, session, subscriber, get_all)
+    # Hand the offers over before sending, so the outbox doesn't pick them up.
+    await run_sync(session.commit)
+    for message in messages:
+        try:
+            await bot.sendMessage(**message)
+            metrics.count_message()
+        except telegram.error.Forbidden as e:
+            metrics.count_error(e)
+            await run_sync(remove_subscriber, session, subscriber)
             return
-    else:
-        if get_all:
-            await bot.sendMessage(
-                chat_id=subscriber.chat_id,
-                parse_mode="Markdown",
-                text="There are currently no offers for your criteria.",
-            )
+
+
+def remove_subscriber(session, subscriber):
+    """Remove a subscriber, who can no longer be reached."""
+    session.delete(subscriber)
+    session.commit()
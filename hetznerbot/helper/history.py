@@ -0,0 +1,80 @@
+"""Helper functions for the price history of offers."""
+
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from hetznerbot.config import config
+from hetznerbot.helper.offer_event import OfferEvent
+from hetznerbot.models import OfferHistory
+
+# Days before the downsampling cutoff, that are checked on every run.
+# Older days have been downsampled by earlier runs already.
+COMPACTION_WINDOW = 7
+
+
+def record_history(session, event, offers):
+    """Append an event for some offers to the history in bulk.
+
+    `offers` are tuples of offer id and price.
+    """
+    if len(offers) == 0:
+        return
+
+    session.execute(
+        insert(OfferHistory),
+        [
+            {"offer_id": offer_id, "event": event, "price": price}
+            for offer_id, price in offers
+        ],
+    )
+
+
+def compact_history(session, full=False):
+    """Delete expired history and downsample old price changes.
+
+    Only the last price change of each offer and day is kept. Additions and
+    removals are always kept. Unless `full` is set, only the most recent days
+    before the cutoff are downsampled.
+    Returns the amount of deleted rows.
+    """
+    history_config = config["history"]
+    deleted = 0
+
+    if history_config["retention_days"] > 0:
+        expiry = datetime.now() - timedelta(days=history_config["retention_days"])
+        result = session.execute(
+            delete(OfferHistory).where(OfferHistory.recorded_at < expiry)
+        )
+        deleted += result.rowcount
+
+    if history_config["downsample_after"] > 0:
+        # Only downsample whole days.
+        cutoff_day = date.today() - timedelta(days=history_config["downsample_after"])
+        cutoff = datetime.combine(cutoff_day, time.min)
+
+        day = func.date_trunc("day", OfferHistory.recorded_at)
+        rank = func.row_number().over(
+            partition_by=(OfferHistory.offer_id, day),
+            order_by=(OfferHistory.recorded_at.desc(), OfferHistory.id.desc()),
+        )
+        ranked = (
+            select(OfferHistory.id, rank.label("rank"))
+            .where(OfferHistory.event == OfferEvent.changed)
+            .where(OfferHistory.recorded_at < cutoff)
+        )
+        if not full:
+            window_start = cutoff - timedelta(days=COMPACTION_WINDOW)
+            ranked = ranked.where(OfferHistory.recorded_at >= window_start)
+        ranked = ranked.subquery()
+
+        result = session.execute(
+            delete(OfferHistory).where(
+                OfferHistory.id.in_(select(ranked.c.id).where(ranked.c.rank > 1))
+            )
+        )
+        deleted += result.rowcount
+
+    session.commit()
+
+    return deleted
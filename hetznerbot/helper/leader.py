@@ -0,0 +1,90 @@
+"""Leader election between multiple replicas via PostgreSQL advisory locks."""
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+
+from hetznerbot.db import engine
+from hetznerbot.helper.diff import offer_snapshot
+from hetznerbot.helper.feed import hetzner_feed
+from hetznerbot.helper.vectorized import vectorized_matcher
+
+# Advisory lock of the replica, which polls Hetzner and matches offers.
+LEADER_LOCK_KEY = 0x6865747A
+
+
+def reset_local_state():
+    """Forget all state about offers, which has been built up by this replica.
+
+    Other leaders may have processed any number of feeds in the meantime,
+    so a new leader has to start with a full diff of the next feed.
+    """
+    offer_snapshot.clear()
+    hetzner_feed.reset()
+    vectorized_matcher.clear()
+
+
+class LeaderLock:
+    """A session-level advisory lock, which is held on a dedicated connection.
+
+    PostgreSQL releases the lock, once that connection is gone.
+    Another replica can then take over.
+    """
+
+    connection = None
+
+    def __init__(self, key):
+        """Create a new lock, which isn't held yet."""
+        self.key = key
+
+    def acquire(self):
+        """Try to become the leader. Returns whether this replica is the leader.
+
+        This is called before every run of the job, so a lost connection is
+        detected in time.
+        """
+        if self.connection is not None:
+            try:
+                self.connection.execute(select(1))
+                self.connection.commit()
+                return True
+            except DBAPIError:
+                print("Lost the connection of the leader lock")
+                self.release()
+
+        connection = engine.connect()
+        try:
+            query = select(func.pg_try_advisory_lock(self.key))
+            acquired = connection.execute(query).scalar()
+            connection.commit()
+        except DBAPIError:
+            connection.invalidate()
+            raise
+
+        if not acquired:
+            connection.close()
+            return False
+
+        print("This replica is the leader now")
+        self.connection = connection
+        reset_local_state()
+        return True
+
+    def is_held(self):
+        """Check whether this replica has been the leader during the last job."""
+        return self.connection is not None
+
+    def release(self):
+        """Give up the lock.
+
+        The connection is invalidated instead of being returned to the pool,
+        which would keep the lock alive.
+        """
+        if self.connection is None:
+            return
+
+        self.connection.invalidate()
+        self.connection.close()
+        self.connection = None
+
+
+leader_lock = LeaderLock(LEADER_LOCK_KEY)
@@ -0,0 +1,143 @@
+"""Set-based matching of offers and subscribers."""
+
+from sqlalchemy import and_, delete, func, or_, select, true
+from sqlalchemy.dialects.postgresql import insert
+
+from hetznerbot.helper.metrics import metrics
+from hetznerbot.helper.outbox import enqueue_notifications
+from hetznerbot.models import Offer, OfferDisk, OfferSubscriber, Subscriber
+
+
+def filter_subscribers(query, subscriber_ids=None):
+    """Restrict a query to the given subscribers.
+
+    Without explicit ids, all authorized and active subscribers are used.
+    """
+    if subscriber_ids is None:
+        return query.where(Subscriber.authorized.is_(True)).where(
+            Subscriber.active.is_(True)
+        )
+
+    return query.where(Subscriber.chat_id.in_(subscriber_ids))
+
+
+def find_matches(session, subscriber_ids=None, offer_ids=None):
+    """Match subscribers and offers with a single statement.
+
+    This evaluates the same criteria as `find_offers_for_subscriber`
+    for all subscribers at once.
+
+    Returns a set of `(offer_id, chat_id)` tuples.
+    """
+    # Sum disk counts across all disk groups where each disk is large enough.
+    # That's only necessary, if some disks of an offer are too small.
+    disk_count_subq = (
+        select(func.sum(OfferDisk.amount))
+        .where(OfferDisk.offer_id == Offer.id)
+        .where(OfferDisk.size >= Subscriber.hdd_size)
+        .correlate(Offer, Subscriber)
+        .scalar_subquery()
+    )
+
+    query = (
+        select(Offer.id, Subscriber.chat_id)
+        .select_from(Subscriber)
+        .join(Offer, true())
+        .where(Offer.deactivated.is_(False))
+        .where(Offer.price <= Subscriber.price * 100)
+        .where(Offer.ram >= Subscriber.ram)
+        .where(Offer.largest_disk_size >= Subscriber.hdd_size)
+        .where(Offer.disk_count >= Subscriber.hdd_count)
+        .where(
+            or_(
+                Offer.smallest_disk_size >= Subscriber.hdd_size,
+                disk_count_subq >= Subscriber.hdd_count,
+            )
+        )
+        .where(Offer.cpu_threads >= Subscriber.threads)
+        .where(Offer.cpu_release_date >= Subscriber.release_date)
+        .where(Offer.cpu_multi_rating >= Subscriber.multi_rating)
+        .where(Offer.cpu_single_rating >= Subscriber.single_rating)
+        .where(
+            or_(
+                Subscriber.raid.is_(None),
+                Subscriber.raid.notin_(["raid5", "raid6"]),
+                and_(
+                    Subscriber.raid == "raid5",
+                    Offer.raid5_capacity >= Subscriber.after_raid,
+                ),
+                and_(
+                    Subscriber.raid == "raid6",
+                    Offer.raid6_capacity >= Subscriber.after_raid,
+                ),
+            )
+        )
+        .where(
+            or_(
+                Subscriber.datacenter.is_(None),
+                Offer.datacenter.startswith(Subscriber.datacenter),
+            )
+        )
+        .where(or_(Subscriber.ipv4.is_(False), Offer.ipv4.is_(True)))
+        .where(or_(Subscriber.ecc.is_(False), Offer.ecc.is_(True)))
+        .where(or_(Subscriber.inic.is_(False), Offer.inic.is_(True)))
+        .where(or_(Subscriber.hwr.is_(False), Offer.hwr.is_(True)))
+    )
+
+    query = filter_subscribers(query, subscriber_ids)
+    if offer_ids is not None:
+        query = query.where(Offer.id.in_(offer_ids))
+
+    return set(session.execute(query).tuples())
+
+
+def reconcile_matches(session, matches, subscriber_ids=None, offer_ids=None):
+    """Bring the `offer_subscriber` table in sync with a set of matches.
+
+    Only rows of the given subscribers and offers are touched.
+    The scope has to be the same that has been used to find the matches.
+
+    New matches are inserted and stale matches are deleted with one statement
+    each. Un-notified matches are added to the outbox.
+    The session isn't committed, that's up to the caller.
+    """
+    query = select(
+        OfferSubscriber.id,
+        OfferSubscriber.offer_id,
+        OfferSubscriber.subscriber_id,
+    ).join(Subscriber, Subscriber.chat_id == OfferSubscriber.subscriber_id)
+    query = filter_subscribers(query, subscriber_ids)
+    if offer_ids is not None:
+        query = query.where(OfferSubscriber.offer_id.in_(offer_ids))
+
+    existing = {
+        (offer_id, subscriber_id): offer_subscriber_id
+        for offer_subscriber_id, offer_id, subscriber_id in session.execute(query)
+    }
+
+    # Add new matches. Matches that have been added concurrently are skipped.
+    new_matches = matches - existing.keys()
+    if len(new_matches) > 0:
+        session.execute(
+            insert(OfferSubscriber).on_conflict_do_nothing(
+                constraint="uniq_offer_subscriber"
+            ),
+            [
+                {"offer_id": offer_id, "subscriber_id": subscriber_id}
+                for offer_id, subscriber_id in new_matches
+            ],
+        )
+
+    # Clean old entries
+    stale_ids = [
+        offer_subscriber_id
+        for match, offer_subscriber_id in existing.items()
+        if match not in matches
+    ]
+    if len(stale_ids) > 0:
+        session.execute(
+            delete(OfferSubscriber).where(OfferSubscriber.id.in_(stale_ids))
+        )
+
+    metrics.count_matches(created=len(new_matches), removed=len(stale_ids))
+    enqueue_notifications(session, subscriber_ids, offer_ids)
@@ -0,0 +1,116 @@
+"""Prometheus metrics of the processing cycle and the delivery.
+
+Requires prometheus-client, which is part of the `metrics` extra.
+All recording methods are no-ops, as long as the metrics haven't been started.
+"""
+
+from contextlib import contextmanager
+
+from hetznerbot.config import config
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Stages range from a few milliseconds to the full polling interval.
+STAGE_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class Metrics:
+    """All metrics of the bot in a separate registry."""
+
+    enabled = False
+
+    def start(self):
+        """Create all metrics and serve them on the configured port."""
+        if prometheus_client is None:
+            raise RuntimeError(
+                "Metrics require prometheus-client. "
+                "Install hetznerbot with the `metrics` extra."
+            )
+
+        registry = prometheus_client.CollectorRegistry()
+        self.stage_duration = prometheus_client.Histogram(
+            "hetznerbot_stage_duration_seconds",
+            "Duration of the stages of the processing cycle and the delivery.",
+            ["stage"],
+            buckets=STAGE_BUCKETS,
+            registry=registry,
+        )
+        self.offers = prometheus_client.Gauge(
+            "hetznerbot_offers",
+            "Active offers in the last processed feed.",
+            registry=registry,
+        )
+        self.subscribers = prometheus_client.Gauge(
+            "hetznerbot_subscribers",
+            "Active and authorized subscribers.",
+            registry=registry,
+        )
+        self.matches = prometheus_client.Counter(
+            "hetznerbot_matches",
+            "Matches between offers and subscribers by change.",
+            ["change"],
+            registry=registry,
+        )
+        self.messages = prometheus_client.Counter(
+            "hetznerbot_messages_sent",
+            "Messages that have been sent to subscribers.",
+            registry=registry,
+        )
+        self.telegram_errors = prometheus_client.Counter(
+            "hetznerbot_telegram_errors",
+            "Errors while sending messages by type.",
+            ["error"],
+            registry=registry,
+        )
+
+        metrics_config = config["metrics"]
+        prometheus_client.start_http_server(
+            metrics_config["port"],
+            addr=metrics_config["listen"],
+            registry=registry,
+        )
+        self.enabled = True
+
+    @contextmanager
+    def time(self, stage):
+        """Measure the duration of a stage."""
+        if not self.enabled:
+            yield
+            return
+
+        with self.stage_duration.labels(stage).time():
+            yield
+
+    def set_counts(self, offers=None, subscribers=None):
+        """Set the current amount of offers and subscribers."""
+        if not self.enabled:
+            return
+
+        if offers is not None:
+            self.offers.set(offers)
+        if subscribers is not None:
+            self.subscribers.set(subscribers)
+
+    def count_matches(self, created=0, removed=0):
+        """Count created and removed matches."""
+        if not self.enabled:
+            return
+
+        self.matches.labels("created").inc(created)
+        self.matches.labels("removed").inc(removed)
+
+    def count_message(self):
+        """Count a sent message."""
+        if self.enabled:
+            self.messages.inc()
+
+    def count_error(self, error):
+        """Count an error of the Telegram API by its type."""
+        if self.enabled:
+            self.telegram_errors.labels(type(error).__name__).inc()
+
+
+metrics = Metrics()
@@ -0,0 +1,7 @@
+import enum
+
+
+class OfferEvent(enum.Enum):
+    added = 1
+    changed = 2
+    removed = 3
@@ -0,0 +1,45 @@
+"""Durable outbox for notifications about offers.
+
+Matching only writes pending notifications into the outbox. They're delivered
+by a separate job, so slow deliveries don't stretch the processing cycle and
+pending notifications survive restarts.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from hetznerbot.models import Notification, OfferSubscriber, Subscriber
+
+
+def enqueue_notifications(session, subscriber_ids=None, offer_ids=None, changed=False):
+    """Add all un-notified matches of the given subscribers and offers to the outbox.
+
+    Only active and authorized subscribers receive notifications.
+    Pass `changed`, if the offers have changed. The version of pending
+    notifications is then bumped, so a running delivery doesn't mark the
+    changed offers as notified. The session isn't committed.
+    """
+    query = (
+        select(OfferSubscriber.id)
+        .join(Subscriber, Subscriber.chat_id == OfferSubscriber.subscriber_id)
+        .where(OfferSubscriber.notified.is_(False))
+        .where(Subscriber.authorized.is_(True))
+        .where(Subscriber.active.is_(True))
+    )
+    if subscriber_ids is not None:
+        query = query.where(OfferSubscriber.subscriber_id.in_(subscriber_ids))
+    if offer_ids is not None:
+        query = query.where(OfferSubscriber.offer_id.in_(offer_ids))
+
+    statement = insert(Notification).from_select(["offer_subscriber_id"], query)
+    if changed:
+        statement = statement.on_conflict_do_update(
+            index_elements=["offer_subscriber_id"],
+            set_={"version": Notification.version + 1, "attempts": 0},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(
+            index_elements=["offer_subscriber_id"]
+        )
+
+    session.execute(statement)
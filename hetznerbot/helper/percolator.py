@@ -0,0 +1,236 @@
+"""Reverse index from offers to interested subscribers.
+
+Instead of running the query of every subscriber, the criteria of all
+subscribers are indexed. Each offer is then routed to its interested
+subscribers.
+
+Sets of subscribers are represented as bitsets (plain ints), where each bit
+stands for the subscriber at that position of the index.
+"""
+
+from bisect import bisect_left, bisect_right
+from threading import RLock
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from hetznerbot.config import config
+from hetznerbot.helper.matching import filter_subscribers
+from hetznerbot.models import Subscriber, VersionStamp
+
+FLAGS = ["ipv4", "ecc", "inic", "hwr"]
+
+# Name of the version stamp, which is bumped whenever a subscriber changes.
+SUBSCRIBER_VERSION = "subscriber"
+
+
+def iter_bits(bits):
+    """Get the positions of all set bits."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class ThresholdIndex:
+    """Subscribers sorted by one of their thresholds.
+
+    `prefixes[n]` contains the n subscribers with the lowest thresholds.
+    """
+
+    def __init__(self, thresholds):
+        """Index a list of thresholds. The position is the subscriber's bit."""
+        order = sorted(range(len(thresholds)), key=thresholds.__getitem__)
+        self.thresholds = [thresholds[position] for position in order]
+
+        self.prefixes = [0]
+        for position in order:
+            self.prefixes.append(self.prefixes[-1] | (1 << position))
+
+    def at_most(self, value):
+        """Get all subscribers whose threshold is lower or equal to the value."""
+        return self.prefixes[bisect_right(self.thresholds, value)]
+
+    def at_least(self, value):
+        """Get all subscribers whose threshold is greater or equal to the value."""
+        return self.prefixes[-1] & ~self.prefixes[bisect_left(self.thresholds, value)]
+
+
+class SubscriberIndex:
+    """An index over the criteria of a fixed list of subscribers."""
+
+    def __init__(self, subscribers):
+        """Build the index."""
+        self.chat_ids = [subscriber.chat_id for subscriber in subscribers]
+
+        # Criteria that are checked for each remaining candidate.
+        self.disk_criteria = [
+            (
+                subscriber.hdd_count,
+                subscriber.hdd_size,
+                subscriber.raid,
+                subscriber.after_raid,
+            )
+            for subscriber in subscribers
+        ]
+
+        def index(get_threshold):
+            return ThresholdIndex([get_threshold(s) for s in subscribers])
+
+        self.price = index(lambda subscriber: subscriber.price * 100)
+        self.ram = index(lambda subscriber: subscriber.ram)
+        self.threads = index(lambda subscriber: subscriber.threads)
+        self.release_date = index(lambda subscriber: subscriber.release_date)
+        self.multi_rating = index(lambda subscriber: subscriber.multi_rating)
+        self.single_rating = index(lambda subscriber: subscriber.single_rating)
+
+        # Subscribers that require a flag.
+        self.flags = dict.fromkeys(FLAGS, 0)
+        # Subscribers that accept any datacenter and by datacenter prefix.
+        self.any_datacenter = 0
+        self.datacenters = {}
+        self.datacenter_cache = {}
+
+        for position, subscriber in enumerate(subscribers):
+            bit = 1 << position
+            for flag in FLAGS:
+                if getattr(subscriber, flag):
+                    self.flags[flag] |= bit
+
+            if subscriber.datacenter is None:
+                self.any_datacenter |= bit
+            else:
+                self.datacenters.setdefault(subscriber.datacenter, 0)
+                self.datacenters[subscriber.datacenter] |= bit
+
+    def get_datacenter_bits(self, datacenter):
+        """Get all subscribers that accept the given datacenter."""
+        if datacenter not in self.datacenter_cache:
+            bits = self.any_datacenter
+            for prefix, prefix_bits in self.datacenters.items():
+                if datacenter is not None and datacenter.startswith(prefix):
+                    bits |= prefix_bits
+            self.datacenter_cache[datacenter] = bits
+
+        return self.datacenter_cache[datacenter]
+
+    def route(self, record, cpu):
+        """Get the chat ids of all subscribers that are interested in an offer.
+
+        `record` is a normalized offer record, `cpu` the stats of its cpu.
+        """
+        # Offers with unknown cpus never match.
+        if cpu is None:
+            return []
+        threads, release_date, multi_rating, single_rating = cpu
+
+        candidates = (
+            self.price.at_least(record["price"])
+            & self.ram.at_most(record["ram"])
+            & self.threads.at_most(threads)
+            & self.release_date.at_most(release_date)
+            & self.multi_rating.at_most(multi_rating)
+            & self.single_rating.at_most(single_rating)
+            & self.get_datacenter_bits(record["datacenter"])
+        )
+
+        for flag in FLAGS:
+            if not record[flag]:
+                candidates &= ~self.flags[flag]
+
+        return [
+            self.chat_ids[position]
+            for position in iter_bits(candidates)
+            if disks_match(record["disks"], *self.disk_criteria[position])
+        ]
+
+
+def disks_match(disks, hdd_count, hdd_size, raid, after_raid):
+    """Check the disks of a normalized offer record against a subscriber."""
+    # Only disks that are large enough count towards the disk count.
+    disk_count = sum(amount for _, size, amount in disks if size >= hdd_size)
+    if disk_count == 0 or disk_count < hdd_count:
+        return False
+
+    if raid == "raid5":
+        return any(
+            amount >= 3 and (amount - 1) * size >= after_raid
+            for _, size, amount in disks
+        )
+    elif raid == "raid6":
+        return any(
+            amount >= 4 and (amount - 2) * size >= after_raid
+            for _, size, amount in disks
+        )
+
+    return True
+
+
+class Percolator:
+    """Keeps the subscriber index in sync with the database.
+
+    The index is rebuilt lazily, once any subscriber has been changed.
+    Subscribers may also be changed by other replicas, which is detected via
+    a version stamp. The index is guarded by a lock for threaded database access.
+    """
+
+    index = None
+    version = None
+
+    def __init__(self):
+        """Create a new percolator without an index."""
+        self.lock = RLock()
+
+    def invalidate(self, mapper, connection, target):
+        """Drop the index. Used as an event listener for subscriber changes.
+
+        The version stamp is bumped once per flush, see `bump_version`.
+        """
+        with self.lock:
+            self.index = None
+        session = object_session(target)
+        if session is not None:
+            session.info[SUBSCRIBER_VERSION] = True
+
+    def bump_version(self, session, flush_context):
+        """Bump the version stamp, if the flush wrote any subscriber.
+
+        Used as an event listener for flushes. The stamp is bumped in the
+        same transaction.
+        """
+        if session.info.pop(SUBSCRIBER_VERSION, False):
+            VersionStamp.increment(session.connection(), SUBSCRIBER_VERSION)
+
+    def get_index(self, session):
+        """Get the index of all active and authorized subscribers."""
+        with self.lock:
+            version = VersionStamp.get_version(session, SUBSCRIBER_VERSION)
+            if self.index is None or version != self.version:
+                subscribers = session.scalars(filter_subscribers(select(Subscriber)))
+                self.index = SubscriberIndex(subscribers.all())
+                self.version = version
+
+            return self.index
+
+    def find_matches(self, session, records, cpus):
+        """Route normalized offer records to their subscribers.
+
+        Returns a set of `(offer_id, chat_id)` tuples.
+        """
+        index = self.get_index(session)
+
+        matches = set()
+        for record in records:
+            for chat_id in index.route(record, cpus.get(record["cpu"])):
+                matches.add((record["key"], chat_id))
+
+        return matches
+
+
+percolator = Percolator()
+
+# Subscriber changes only have to be tracked, if the index is used at all.
+if config["matching"]["mode"] == "percolator":
+    for event_name in ["after_insert", "after_update", "after_delete"]:
+        event.listen(Subscriber, event_name, percolator.invalidate)
+    event.listen(Session, "after_flush", percolator.bump_version)
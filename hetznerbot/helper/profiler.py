@@ -0,0 +1,130 @@
+"""Opt-in profiler for the SQL statements of jobs and commands.
+
+Statements are counted and timed for each invocation of a session wrapper
+and grouped by their normalized SQL. This makes hidden lazy loads visible.
+"""
+
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prettytable import PrettyTable
+from sqlalchemy import event
+
+from hetznerbot.config import config
+from hetznerbot.db import engine
+
+# The profile of the currently running job or command.
+current_profile = ContextVar("current_profile", default=None)
+
+PARAMETER = re.compile(r"%\(\w+\)s|\b\d+\b|'(?:[^']|'')*'")
+PARAMETER_LIST = re.compile(r"\?(?:, \?)+")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Replace all parameters and literals, so similar statements are grouped."""
+    statement = WHITESPACE.sub(" ", statement).strip()
+    statement = PARAMETER.sub("?", statement)
+    return PARAMETER_LIST.sub("?, ...", statement)
+
+
+class Profile:
+    """Count and duration of all statements of a single invocation."""
+
+    def __init__(self, name):
+        """Create a new, empty profile."""
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        # Count and seconds by normalized statement.
+        self.statements = {}
+
+    def add(self, statement, seconds):
+        """Record a single statement."""
+        self.queries += 1
+        self.seconds += seconds
+
+        stats = self.statements.setdefault(normalize_sql(statement), [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+    def get_report(self, top):
+        """Format the statements, which took the most time in total."""
+        table = PrettyTable()
+        table.field_names = ["Count", "Total (ms)", "Statement"]
+        table.align = "r"
+        table.align["Statement"] = "l"
+        table.max_width["Statement"] = 100
+
+        statements = sorted(
+            self.statements.items(), key=lambda item: item[1][1], reverse=True
+        )
+        for statement, (count, seconds) in statements[:top]:
+            table.add_row([count, f"{seconds * 1000:.1f}", statement])
+
+        return (
+            f"{self.name}: {self.queries} queries in {self.seconds * 1000:.1f} ms\n"
+            + table.get_string()
+        )
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """Remember the start of a statement."""
+    if current_profile.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    """Record a finished statement in the current profile."""
+    profile = current_profile.get()
+    if profile is not None and conn.info.get("query_start"):
+        start = conn.info["query_start"].pop()
+        profile.add(statement, time.perf_counter() - start)
+
+
+class Profiler:
+    """Profiles the statements of jobs and commands, if enabled."""
+
+    listening = False
+
+    def listen(self):
+        """Register the engine event listeners once."""
+        if self.listening:
+            return
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        self.listening = True
+
+    @contextmanager
+    def profile(self, name):
+        """Profile all statements within this context.
+
+        Afterwards, the top offenders are logged. A warning is logged, if the
+        statements exceed the query budget.
+        """
+        profiler_config = config["profiler"]
+        if not profiler_config["enabled"]:
+            yield
+            return
+
+        self.listen()
+        profile = Profile(name)
+        token = current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            current_profile.reset(token)
+
+        print(profile.get_report(profiler_config["top"]))
+        budget = profiler_config["query_budget"]
+        if budget > 0 and profile.queries > budget:
+            print(
+                f"WARNING: {name} exceeded the query budget "
+                + f"with {profile.queries} of {budget} queries"
+            )
+
+
+profiler = Profiler()
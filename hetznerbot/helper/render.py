@@ -0,0 +1,64 @@
+"""Cache for formatted offers, which is shared between all subscribers."""
+
+from threading import RLock
+
+# The cache is simply cleared, once it holds more offers than this.
+# Only relevant for replicas, which don't evict deactivated offers themselves.
+MAX_OFFERS = 20000
+
+
+class RenderCache:
+    """Formatted offers by offer id.
+
+    Each offer is cached for a single version of its content. For that version,
+    there may be multiple variants, e.g. for the raid mode of the subscriber.
+
+    The cache is guarded by a lock for threaded database access.
+    Offers are rendered outside of the lock.
+    """
+
+    def __init__(self):
+        """Create a new, empty cache."""
+        self.lock = RLock()
+        self.offers = {}
+
+    def get(self, offer_id, version, variant, render):
+        """Get a formatted offer. `render` is only called on a cache miss.
+
+        Outdated versions of the offer are dropped.
+        """
+        with self.lock:
+            variants = self.get_variants(offer_id, version)
+            if variant in variants:
+                return variants[variant]
+
+        formatted = render()
+        with self.lock:
+            variants = self.get_variants(offer_id, version)
+            return variants.setdefault(variant, formatted)
+
+    def get_variants(self, offer_id, version):
+        """Get the cached variants of an offer's version. The lock has to be held."""
+        cached_version, variants = self.offers.get(offer_id, (None, None))
+        if variants is None or cached_version != version:
+            if len(self.offers) >= MAX_OFFERS:
+                self.clear()
+
+            variants = {}
+            self.offers[offer_id] = (version, variants)
+
+        return variants
+
+    def evict(self, offer_ids):
+        """Forget all formatted versions of the given offers."""
+        with self.lock:
+            for offer_id in offer_ids:
+                self.offers.pop(offer_id, None)
+
+    def clear(self):
+        """Forget all formatted offers."""
+        with self.lock:
+            self.offers = {}
+
+
+render_cache = RenderCache()
@@ -0,0 +1,147 @@
+"""Recording and loading of compressed offer feed snapshots.
+
+Snapshots are either full or delta encoded:
+
+- Full snapshots contain the gzipped feed as it has been downloaded.
+- Delta snapshots contain all offers that were added or changed
+  and the keys of all removed offers compared to the previous snapshot.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from json import JSONDecodeError
+
+from hetznerbot.config import config
+from hetznerbot.helper.feed import dump_offer, iter_offers
+from hetznerbot.sentry import sentry
+
+FULL_SUFFIX = ".full.json.gz"
+DELTA_SUFFIX = ".delta.json.gz"
+
+
+def get_snapshot_dir():
+    """Get the configured snapshot directory."""
+    return os.path.expanduser(config["recorder"]["path"])
+
+
+class SnapshotRecorder:
+    """Archive every fetched feed as a timestamped snapshot."""
+
+    # Name of the last recorded snapshot and the digests of its offers by key.
+    previous = None
+    previous_digests = None
+
+    # The amount of delta snapshots since the last full snapshot.
+    deltas_since_full = 0
+
+    def record(self, stream):
+        """Record a snapshot of an `OfferStream`."""
+        recorder_config = config["recorder"]
+        if not recorder_config["enabled"]:
+            return
+
+        try:
+            os.makedirs(get_snapshot_dir(), exist_ok=True)
+
+            digests = {}
+            changed = []
+            for offer in stream:
+                serialized = dump_offer(offer)
+                digest = hashlib.sha1(serialized.encode()).digest()
+                digests[offer["key"]] = digest
+
+                if (
+                    self.previous_digests is None
+                    or self.previous_digests.get(offer["key"]) != digest
+                ):
+                    changed.append(offer)
+
+            name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+            if (
+                recorder_config["delta"]
+                and self.previous is not None
+                and self.deltas_since_full < recorder_config["full_interval"]
+            ):
+                removed = list(self.previous_digests.keys() - digests.keys())
+                name += DELTA_SUFFIX
+                self.write_delta(name, changed, removed)
+                self.deltas_since_full += 1
+            else:
+                name += FULL_SUFFIX
+                self.write_full(name, stream)
+                self.deltas_since_full = 0
+
+            self.previous = name
+            self.previous_digests = digests
+        except (OSError, JSONDecodeError, UnicodeDecodeError):
+            print("Failed to record feed snapshot.")
+            sentry.capture_exception()
+
+    def write_full(self, name, stream):
+        """Write the compressed raw feed."""
+        path = os.path.join(get_snapshot_dir(), name)
+        stream.file.seek(0)
+        with gzip.open(f"{path}.tmp", "wb") as file:
+            shutil.copyfileobj(stream.file, file)
+        os.replace(f"{path}.tmp", path)
+
+    def write_delta(self, name, changed, removed):
+        """Write the difference to the previous snapshot."""
+        path = os.path.join(get_snapshot_dir(), name)
+        delta = {
+            "base": self.previous,
+            "changed": changed,
+            "removed": removed,
+        }
+        with gzip.open(f"{path}.tmp", "wt") as file:
+            json.dump(delta, file, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+
+def list_snapshots(path):
+    """Get the names of all snapshots in a directory in chronological order."""
+    return sorted(
+        name
+        for name in os.listdir(path)
+        if name.endswith(FULL_SUFFIX) or name.endswith(DELTA_SUFFIX)
+    )
+
+
+def iter_snapshots(path):
+    """Load all snapshots of a directory in chronological order.
+
+    Yields the name of each snapshot and the list of offers it contains.
+    Delta snapshots are applied to the previous snapshot. Leading delta snapshots,
+    whose full snapshot is missing, are skipped.
+    """
+    previous = None
+    offers = None
+    for name in list_snapshots(path):
+        snapshot_path = os.path.join(path, name)
+        if name.endswith(FULL_SUFFIX):
+            with gzip.open(snapshot_path, "rb") as file:
+                offers = {offer["key"]: offer for offer in iter_offers(file)}
+        else:
+            with gzip.open(snapshot_path, "rt") as file:
+                delta = json.load(file)
+
+            if offers is None:
+                print(f"Skipping snapshot {name} without full snapshot.")
+                continue
+            if delta["base"] != previous:
+                raise ValueError(f"Snapshot {name} isn't based on {previous}")
+
+            for key in delta["removed"]:
+                del offers[key]
+            for offer in delta["changed"]:
+                offers[offer["key"]] = offer
+
+        previous = name
+        yield name, list(offers.values())
+
+
+snapshot_recorder = SnapshotRecorder()
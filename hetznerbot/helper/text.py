@@ -8,6 +8,15 @@ def split_text(lines, max_chunks=5):
 
     Telegram's maximum message size is 4096 characters.
     """
+    return ["\n\n".join(chunk) for chunk in split_lines(lines, max_chunks)]
+
+
+def split_lines(lines, max_chunks=5):
+    """Split the lines into chunks, which can be joined by `split_text`.
+
+    Returns the lines of each chunk. Lines that don't fit into `max_chunks`
+    chunks are dropped.
+    """
     chunks = []
     current_chunk = []
 
@@ -25,12 +34,12 @@ def split_text(lines, max_chunks=5):
         # We exceed the max chunk size. Start a new chunk
         else:
             char_count = count
-            chunks.append("\n\n".join(current_chunk))
+            chunks.append(current_chunk)
             current_chunk = [line]
 
             # We reached the max chunk size. Early return
             if len(chunks) == max_chunks:
                 return chunks
 
-    chunks.append("\n\n".join(current_chunk))
+    chunks.append(current_chunk)
     return chunks
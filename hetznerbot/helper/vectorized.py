@@ -0,0 +1,270 @@
+"""Vectorized in-memory matching of offers and subscribers.
+
+All active offers are kept as numpy column arrays. The criteria of each
+subscriber are then evaluated as boolean mask operations on those columns.
+
+Requires numpy, which is part of the `vectorized` extra.
+"""
+
+from threading import RLock
+
+from sqlalchemy import select
+
+from hetznerbot.helper.cpu import cpu_catalog
+from hetznerbot.helper.diff import OFFER_VERSION, load_records
+from hetznerbot.helper.matching import filter_subscribers
+from hetznerbot.models import Subscriber, VersionStamp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_disk_sizes(records):
+    """Get all distinct disk sizes of the given records in ascending order."""
+    return sorted({size for record in records for _, size, _ in record["disks"]})
+
+
+class OfferColumns:
+    """Column arrays of all active offers.
+
+    Disks are stored as a matrix with a column for each distinct disk size.
+    Each cell contains the amount of disks of an offer that are at least that large.
+    """
+
+    def __init__(self, records, cpus):
+        """Build the columns from normalized offer records and cpu stats."""
+        records = list(records)
+        rows = len(records)
+
+        self.index = {}
+        self.ids = np.zeros(rows, dtype=np.int64)
+        self.price = np.zeros(rows, dtype=np.int64)
+        self.ram = np.zeros(rows, dtype=np.int64)
+
+        # Offers with unknown cpus never match.
+        self.has_cpu = np.zeros(rows, dtype=bool)
+        self.threads = np.zeros(rows, dtype=np.int64)
+        self.release_date = np.zeros(rows, dtype=np.int64)
+        self.multi_rating = np.zeros(rows, dtype=np.int64)
+        self.single_rating = np.zeros(rows, dtype=np.int64)
+
+        self.ecc = np.zeros(rows, dtype=bool)
+        self.ipv4 = np.zeros(rows, dtype=bool)
+        self.inic = np.zeros(rows, dtype=bool)
+        self.hwr = np.zeros(rows, dtype=bool)
+        self.datacenters = [""] * rows
+        self.datacenter_masks = {}
+
+        # The best raid capacity or -1, if the raid level isn't possible.
+        self.raid5 = np.zeros(rows, dtype=np.int64)
+        self.raid6 = np.zeros(rows, dtype=np.int64)
+        self.disk_sizes = np.array(get_disk_sizes(records), dtype=np.int64)
+        self.disk_counts = np.zeros((rows, len(self.disk_sizes)), dtype=np.int64)
+
+        for row, record in enumerate(records):
+            self.index[record["key"]] = row
+            self.set_row(row, record, cpus)
+
+    def set_row(self, row, record, cpus):
+        """Write a single record into the columns."""
+        self.ids[row] = record["key"]
+        self.price[row] = record["price"]
+        self.ram[row] = record["ram"]
+
+        cpu = cpus.get(record["cpu"])
+        self.has_cpu[row] = cpu is not None
+        (
+            self.threads[row],
+            self.release_date[row],
+            self.multi_rating[row],
+            self.single_rating[row],
+        ) = cpu if cpu is not None else (0, 0, 0, 0)
+
+        self.ecc[row] = record["ecc"]
+        self.ipv4[row] = record["ipv4"]
+        self.inic[row] = record["inic"]
+        self.hwr[row] = record["hwr"]
+        self.datacenters[row] = record["datacenter"] or ""
+        self.datacenter_masks = {}
+
+        raid5 = -1
+        raid6 = -1
+        self.disk_counts[row] = 0
+        for _, size, amount in record["disks"]:
+            column = np.searchsorted(self.disk_sizes, size)
+            self.disk_counts[row, : column + 1] += amount
+
+            if amount >= 3:
+                raid5 = max(raid5, (amount - 1) * size)
+            if amount >= 4:
+                raid6 = max(raid6, (amount - 2) * size)
+
+        self.raid5[row] = raid5
+        self.raid6[row] = raid6
+
+    def patch(self, records, cpus):
+        """Update the rows of existing offers in place.
+
+        Returns `False` if that's not possible, in which case the columns have to
+        be rebuilt.
+        """
+        disk_sizes = set(self.disk_sizes.tolist())
+        for record in records:
+            if record["key"] not in self.index:
+                return False
+            if not set(get_disk_sizes([record])) <= disk_sizes:
+                return False
+
+        for record in records:
+            self.set_row(self.index[record["key"]], record, cpus)
+
+        return True
+
+    def get_datacenter_mask(self, datacenter):
+        """Get all offers whose datacenter starts with the given location."""
+        if datacenter not in self.datacenter_masks:
+            self.datacenter_masks[datacenter] = np.array(
+                [name.startswith(datacenter) for name in self.datacenters],
+                dtype=bool,
+            )
+
+        return self.datacenter_masks[datacenter]
+
+    def match(self, subscriber, mask):
+        """Get the ids of all offers of a mask that match a subscriber."""
+        # Only disks that are large enough count towards the disk count.
+        column = np.searchsorted(self.disk_sizes, subscriber.hdd_size)
+        if column == len(self.disk_sizes):
+            return self.ids[:0]
+        disk_counts = self.disk_counts[:, column]
+
+        mask = (
+            mask
+            & (self.price <= subscriber.price * 100)
+            & (self.ram >= subscriber.ram)
+            & (disk_counts > 0)
+            & (disk_counts >= subscriber.hdd_count)
+            & self.has_cpu
+            & (self.threads >= subscriber.threads)
+            & (self.release_date >= subscriber.release_date)
+            & (self.multi_rating >= subscriber.multi_rating)
+            & (self.single_rating >= subscriber.single_rating)
+        )
+
+        if subscriber.raid == "raid5":
+            mask &= self.raid5 >= subscriber.after_raid
+        elif subscriber.raid == "raid6":
+            mask &= self.raid6 >= subscriber.after_raid
+
+        if subscriber.datacenter is not None:
+            mask &= self.get_datacenter_mask(subscriber.datacenter)
+
+        if subscriber.ipv4:
+            mask &= self.ipv4
+        if subscriber.ecc:
+            mask &= self.ecc
+        if subscriber.inic:
+            mask &= self.inic
+        if subscriber.hwr:
+            mask &= self.hwr
+
+        return self.ids[mask]
+
+    def find_matches(self, subscribers, offer_ids=None):
+        """Match subscribers against all offers or only the given ones.
+
+        Returns a set of `(offer_id, chat_id)` tuples.
+        """
+        if offer_ids is None:
+            mask = np.ones(len(self.ids), dtype=bool)
+        else:
+            mask = np.isin(self.ids, np.fromiter(offer_ids, dtype=np.int64))
+
+        matches = set()
+        for subscriber in subscribers:
+            for offer_id in self.match(subscriber, mask).tolist():
+                matches.add((offer_id, subscriber.chat_id))
+
+        return matches
+
+
+class VectorizedMatcher:
+    """Keeps the offer columns in sync with the database.
+
+    The columns are patched in place, so they're guarded by a lock for
+    threaded database access. Offers may also be updated by another replica,
+    which is detected via a version stamp.
+    """
+
+    columns = None
+    cpus = None
+    # The version stamp of the offers, which the columns have been built from.
+    version = None
+
+    def __init__(self):
+        """Create a new matcher without any columns."""
+        self.lock = RLock()
+
+    def update(self, session, diff=None):
+        """Patch or rebuild the columns after offers have been updated.
+
+        Without a diff, the columns are rebuilt from the database.
+        """
+        with self.lock:
+            cpus = cpu_catalog.get_cpus(session)
+            if diff is None:
+                self.columns = OfferColumns(load_records(session).values(), cpus)
+            elif (
+                self.columns is None
+                or cpus is not self.cpus
+                or diff.full
+                or len(diff.added + diff.removed) > 0
+                or not self.columns.patch(diff.get_changed_records(), cpus)
+            ):
+                self.columns = OfferColumns(diff.records.values(), cpus)
+
+            self.cpus = cpus
+            self.version = VersionStamp.get_version(session, OFFER_VERSION)
+
+    def clear(self):
+        """Drop the columns. They're rebuilt from the database, once needed."""
+        with self.lock:
+            self.columns = None
+            self.cpus = None
+            self.version = None
+
+    def find_matches(self, session, subscriber_ids=None, offer_ids=None):
+        """Match subscribers against the columns.
+
+        The scope is the same as for `matching.find_matches`.
+        """
+        query = filter_subscribers(select(Subscriber), subscriber_ids)
+        subscribers = session.scalars(query).all()
+
+        with self.lock:
+            # Followers never see a diff, the leader updates offers for them.
+            version = VersionStamp.get_version(session, OFFER_VERSION)
+            if (
+                self.columns is None
+                or version != self.version
+                or cpu_catalog.get_cpus(session) is not self.cpus
+            ):
+                self.update(session)
+
+            return self.columns.find_matches(subscribers, offer_ids)
+
+
+def get_vectorized_matcher():
+    """Get the vectorized matcher. Fail early, if numpy isn't installed."""
+    if np is None:
+        raise RuntimeError(
+            "The vectorized matching mode requires numpy. "
+            "Install hetznerbot with the `vectorized` extra."
+        )
+
+    return vectorized_matcher
+
+
+vectorized_matcher = VectorizedMatcher()
@@ -12,7 +12,17 @@ from hetznerbot.commands import (
     stop,
 )
 from hetznerbot.config import config
-from hetznerbot.jobs import process_all
+from hetznerbot.helper.feed import hetzner_feed
+from hetznerbot.helper.leader import leader_lock
+from hetznerbot.helper.metrics import metrics
+from hetznerbot.jobs import compact_offer_history, deliver_outbox, process_all
+
+
+async def shutdown(app):
+    """Clean up resources that live as long as the application."""
+    await hetzner_feed.close()
+    # Let another replica take over right away.
+    leader_lock.release()
 
 
 def init_app():
@@ -26,13 +36,30 @@ def init_app():
     app = (
         Application.builder()
         .token(config["telegram"]["api_key"])
+        .base_url(config["telegram"]["base_url"])
         .concurrent_updates(config["telegram"]["worker_count"])
+        .post_shutdown(shutdown)
         .build()
     )
 
+    if config["metrics"]["enabled"]:
+        metrics.start()
+
     # Create jobs
     job_queue = app.job_queue
     job_queue.run_repeating(process_all, interval=120, first=5, name="Process all")
+    job_queue.run_repeating(
+        deliver_outbox,
+        interval=config["dispatch"]["outbox_interval"],
+        first=10,
+        name="Deliver outbox",
+    )
+    job_queue.run_repeating(
+        compact_offer_history,
+        interval=24 * 60 * 60,
+        first=60,
+        name="Compact offer history",
+    )
 
     # Create handler
     help_handler = CommandHandler("help", send_help_text, block=False)
@@ -1,45 +1,93 @@
-from sqlalchemy import select
-from telegram.error import BadRequest, Forbidden
+from sqlalchemy import func, select
 
+from hetznerbot.config import config
+from hetznerbot.helper.cpu import cpu_catalog
+from hetznerbot.helper.diff import offer_snapshot
+from hetznerbot.helper.dispatch import deliver_notifications
+from hetznerbot.helper.executor import run_sync
+from hetznerbot.helper.feed import hetzner_feed
 from hetznerbot.helper.hetzner import (
     check_offers_for_subscribers,
     get_hetzner_offers,
     notify_about_new_cpu,
-    send_offers,
     update_offers,
 )
+from hetznerbot.helper.history import compact_history
+from hetznerbot.helper.leader import leader_lock
+from hetznerbot.helper.matching import filter_subscribers
+from hetznerbot.helper.metrics import metrics
 from hetznerbot.helper.session import job_session_wrapper
 from hetznerbot.models import Subscriber
+from hetznerbot.sentry import sentry
 
 
 @job_session_wrapper
 async def process_all(context, session):
-    """Check for every subscriber."""
-    # Get hetzner offers. Early return if it doesn't work
-    incoming_offers = get_hetzner_offers()
-    if incoming_offers is None:
+    """Check for every subscriber.
+
+    New matches are only written to the outbox, which is drained by `deliver_outbox`.
+    In a cluster, only the leader runs this job.
+    """
+    if config["cluster"]["enabled"] and not await run_sync(leader_lock.acquire):
+        return
+
+    # Get hetzner offers. Early return if it doesn't work.
+    with metrics.time("get_hetzner_offers"), sentry.span("fetch"):
+        incoming_offers = await get_hetzner_offers(conditional=True)
+    if incoming_offers is None and not hetzner_feed.unchanged:
         print("Failed to receive Hetzner offers")
         return
 
-    update_offers(session, incoming_offers)
-    check_offers_for_subscribers(session)
-    await notify_about_new_cpu(context, session)
-
-    query = (
-        select(Subscriber)
-        .filter(Subscriber.authorized.is_(True))
-        .filter(Subscriber.active.is_(True))
-    )
-
-    subscribers = session.scalars(query).all()
-    for subscriber in subscribers:
-        try:
-            await send_offers(context.bot, subscriber, session)
-        except BadRequest as e:
-            if e.message == "Chat not found":
-                session.delete(subscriber)
-                session.commit()
-        # Bot was removed from group
-        except Forbidden:
-            session.delete(subscriber)
-            session.commit()
+    # Pick up cpu data that has been imported since the last run.
+    cpus_changed = await run_sync(cpu_catalog.refresh, session)
+
+    # The offers didn't change. New cpu data may still affect any offer.
+    # Early return if nothing changed at all.
+    if hetzner_feed.unchanged:
+        if cpus_changed:
+            with (
+                metrics.time("check_offers_for_subscribers"),
+                sentry.span("match", mode=config["matching"]["mode"]),
+            ):
+                await run_sync(check_offers_for_subscribers, session)
+        return
+
+    # Only check offers that have been added or changed.
+    # New cpu data may affect any offer, so all offers are checked in that case.
+    with metrics.time("update_offers"), sentry.span("ingest"):
+        diff = await run_sync(update_offers, session, incoming_offers)
+    with (
+        metrics.time("check_offers_for_subscribers"),
+        sentry.span("match", mode=config["matching"]["mode"]),
+    ):
+        if cpus_changed:
+            await run_sync(check_offers_for_subscribers, session)
+        elif not diff.is_empty():
+            await run_sync(check_offers_for_subscribers, session, diff)
+    with metrics.time("notify_about_new_cpu"), sentry.span("notify_cpu"):
+        await notify_about_new_cpu(context, session, diff.records.values())
+
+    if metrics.enabled:
+        query = filter_subscribers(select(func.count()).select_from(Subscriber))
+        subscribers = await run_sync(session.scalar, query)
+        metrics.set_counts(offers=len(diff.records), subscribers=subscribers)
+
+    # The feed has been reconciled, don't process it again until it changes.
+    hetzner_feed.mark_processed()
+    offer_snapshot.apply(diff)
+
+
+@job_session_wrapper
+async def deliver_outbox(context, session):
+    """Deliver pending notifications about offers."""
+    await deliver_notifications(session, context.bot)
+
+
+@job_session_wrapper
+async def compact_offer_history(context, session):
+    """Delete expired and downsample old offer history."""
+    # The history is shared, so one replica is enough.
+    if config["cluster"]["enabled"] and not await run_sync(leader_lock.acquire):
+        return
+
+    await run_sync(compact_history, session)
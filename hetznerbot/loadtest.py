@@ -0,0 +1,146 @@
+"""Load test of the notification delivery against a fake Telegram server.
+
+A synthetic workload is matched against a scratch database. The outbox is then
+drained through the real dispatcher, which talks to `FakeTelegram`.
+"""
+
+import random
+import time
+
+from prettytable import PrettyTable
+from sqlalchemy import func, select
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from hetznerbot.benchmark import (
+    generate_offers,
+    generate_subscriber,
+    load_cpu_names,
+    reset,
+)
+from hetznerbot.fake_telegram import OK
+from hetznerbot.helper.cpu import cpu_catalog, import_cpu_csv
+from hetznerbot.helper.dispatch import deliver_notifications
+from hetznerbot.helper.hetzner import check_offers_for_subscribers, update_offers
+from hetznerbot.models import Notification, Subscriber
+
+
+class TimedBot:
+    """Wrapper of a telegram bot, which measures the latency of every message."""
+
+    def __init__(self, bot):
+        """Wrap a bot."""
+        self.bot = bot
+        self.latencies = []
+
+    async def send_message(self, *args, **kwargs):
+        """Send a message and measure the time until Telegram answered."""
+        start = time.perf_counter()
+        try:
+            return await self.bot.send_message(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def get_percentile(values, percentile):
+    """Get the nearest-rank percentile of some values."""
+    if len(values) == 0:
+        return 0
+
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percentile / 100))
+    return values[index]
+
+
+class LoadTest:
+    """Drive a full matching and delivery cycle for many subscribers."""
+
+    def __init__(self, engine, session_factory, fake, seed=0):
+        """Create a new load test against a running fake server."""
+        self.engine = engine
+        self.session_factory = session_factory
+        self.fake = fake
+        self.seed = seed
+
+        self.subscribers = 0
+        self.notifications = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.latencies = []
+        self.remaining = 0
+        self.removed = 0
+
+    def prepare(self, session, offer_count, subscriber_count):
+        """Fill the outbox with the matches of a synthetic workload."""
+        rng = random.Random(self.seed)
+        cpu_names = load_cpu_names()
+
+        reset(self.engine)
+        import_cpu_csv(session, verbose=False)
+        # Chat ids start at 1, as a chat with id 0 can't exist.
+        session.add_all(
+            generate_subscriber(rng, chat_id)
+            for chat_id in range(1, subscriber_count + 1)
+        )
+        session.commit()
+        cpu_catalog.refresh(session)
+
+        update_offers(session, generate_offers(rng, offer_count, cpu_names))
+        check_offers_for_subscribers(session)
+
+        self.subscribers = subscriber_count
+        self.notifications = session.scalar(select(func.count(Notification.id)))
+
+    async def run(self, base_url, offer_count, subscriber_count):
+        """Run the load test, until no notification is due anymore."""
+        session = self.session_factory()
+        self.prepare(session, offer_count, subscriber_count)
+        print(f"Delivering {self.notifications} notifications")
+
+        # The same connection pool size as the bot of the application.
+        bot = TimedBot(
+            Bot(
+                "loadtest",
+                base_url=base_url,
+                request=HTTPXRequest(connection_pool_size=256),
+            )
+        )
+        async with bot.bot:
+            start = time.perf_counter()
+            # Failed deliveries aren't due again before the retry delay.
+            while await deliver_notifications(session, bot) > 0:
+                self.batches += 1
+            self.seconds = time.perf_counter() - start
+
+        self.latencies = bot.latencies
+        self.remaining = session.scalar(select(func.count(Notification.id)))
+        subscribers = session.scalar(select(func.count(Subscriber.chat_id)))
+        self.removed = subscriber_count - subscribers
+        session.close()
+
+    def get_report(self):
+        """Format the results as a table."""
+        messages = self.fake.outcomes[OK]
+        throughput = messages / self.seconds if self.seconds > 0 else 0
+
+        table = PrettyTable()
+        table.field_names = ["Metric", "Value"]
+        table.align = "r"
+        table.align["Metric"] = "l"
+        table.add_row(["Subscribers", self.subscribers])
+        table.add_row(["Notifications", self.notifications])
+        table.add_row(["Batches", self.batches])
+        table.add_row(["Duration (s)", f"{self.seconds:.2f}"])
+        table.add_row(["Messages sent", messages])
+        table.add_row(["Messages/s", f"{throughput:.1f}"])
+        for percentile in [50, 95, 99]:
+            latency = get_percentile(self.latencies, percentile)
+            table.add_row([f"Latency p{percentile} (ms)", f"{latency * 1000:.1f}"])
+        latency = max(self.latencies, default=0)
+        table.add_row(["Latency max (ms)", f"{latency * 1000:.1f}"])
+        for outcome, count in sorted(self.fake.outcomes.items()):
+            table.add_row([f"Responses {outcome}", count])
+        table.add_row(["Removed subscribers", self.removed])
+        table.add_row(["Notifications left", self.remaining])
+
+        return table.get_string()
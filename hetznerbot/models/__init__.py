@@ -1,5 +1,8 @@
 from hetznerbot.models.cpu import Cpu  # noqa
+from hetznerbot.models.notification import Notification  # noqa
 from hetznerbot.models.offer import Offer  # noqa
 from hetznerbot.models.offer_disk import OfferDisk  # noqa
+from hetznerbot.models.offer_history import OfferHistory  # noqa
 from hetznerbot.models.offer_subscriber import OfferSubscriber  # noqa
 from hetznerbot.models.subscriber import Subscriber  # noqa
+from hetznerbot.models.version_stamp import VersionStamp  # noqa
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, func
+from sqlalchemy.orm import relationship
+
+from hetznerbot.db import base
+
+
+class Notification(base):
+    """A pending notification about an offer in the outbox.
+
+    Entries are created, once an `offer_subscriber` becomes un-notified.
+    They're removed, after the offer has been delivered to the subscriber.
+    """
+
+    __tablename__ = "notification"
+
+    id = Column(Integer, primary_key=True)
+    offer_subscriber_id = Column(
+        Integer,
+        ForeignKey("offer_subscriber.id", ondelete="cascade"),
+        unique=True,
+        nullable=False,
+    )
+    # Bumped whenever the offer changes again, while it's still pending.
+    version = Column(Integer, nullable=False, server_default="0")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(
+        DateTime, server_default=func.now(), index=True, nullable=False
+    )
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    offer_subscriber = relationship("OfferSubscriber")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, func
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, func, text
 from sqlalchemy.orm import relationship
 
 from hetznerbot.db import base
@@ -8,6 +8,27 @@ class Offer(base):
     """The database model for an offer."""
 
     __tablename__ = "offer"
+    __table_args__ = (
+        # Only active offers are ever matched against subscribers.
+        Index(
+            "ix_offer_active_price_ram",
+            "price",
+            "ram",
+            postgresql_where=text("NOT deactivated"),
+        ),
+        Index(
+            "ix_offer_active_disks",
+            "largest_disk_size",
+            "disk_count",
+            postgresql_where=text("NOT deactivated"),
+        ),
+        Index(
+            "ix_offer_active_cpu",
+            "cpu_multi_rating",
+            "cpu_single_rating",
+            postgresql_where=text("NOT deactivated"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     deactivated = Column(Boolean, nullable=False, server_default="FALSE")
@@ -16,6 +37,22 @@ class Offer(base):
     ram = Column(Integer, nullable=False)
     datacenter = Column(String, nullable=True)
 
+    # Canonical representation of all disks. See `get_disk_signature`.
+    disk_signature = Column(String, nullable=False, server_default="")
+
+    # Derived from the disks for matching. See `get_disk_stats`.
+    disk_count = Column(Integer, nullable=False, server_default="0")
+    smallest_disk_size = Column(Integer, nullable=True)
+    largest_disk_size = Column(Integer, nullable=True)
+    raid5_capacity = Column(Integer, nullable=True)
+    raid6_capacity = Column(Integer, nullable=True)
+
+    # Denormalized stats of the cpu. Empty, if the cpu is unknown.
+    cpu_threads = Column(Integer, nullable=True)
+    cpu_release_date = Column(Integer, nullable=True)
+    cpu_multi_rating = Column(Integer, nullable=True)
+    cpu_single_rating = Column(Integer, nullable=True)
+
     # Specials
     ecc = Column(Boolean, nullable=False, server_default="FALSE")
     inic = Column(Boolean, nullable=False, server_default="FALSE")
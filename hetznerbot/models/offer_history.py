@@ -0,0 +1,29 @@
+from sqlalchemy import BigInteger, Column, DateTime, Enum, Index, Integer, func
+
+from hetznerbot.db import base
+from hetznerbot.helper.offer_event import OfferEvent
+
+
+class OfferHistory(base):
+    """An append-only event in the life of an offer.
+
+    Offers are recorded, when they're added, when their price changes and
+    when they're removed. Old price changes are downsampled, see `compact_history`.
+    """
+
+    __tablename__ = "offer_history"
+    __table_args__ = (
+        # Rows are appended in time order, so a tiny BRIN index is enough
+        # for range scans over the whole history.
+        Index("ix_offer_history_recorded_at", "recorded_at", postgresql_using="brin"),
+        Index("ix_offer_history_offer_id_recorded_at", "offer_id", "recorded_at"),
+    )
+
+    # SQLite only autoincrements plain integer primary keys.
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    # No foreign key, so appending never has to touch the hot offer table.
+    offer_id = Column(Integer, nullable=False)
+    event = Column(Enum(OfferEvent), nullable=False)
+    # The net price in cents at the time of the event.
+    price = Column(Integer, nullable=False)
+    recorded_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -41,6 +41,14 @@ class Subscriber(base):
         """Create a new subscriber."""
         self.chat_id = chat_id
 
+    def is_matched_by_job(self):
+        """Check whether the matches of this subscriber are kept up to date.
+
+        The job only matches changed offers against active and authorized
+        subscribers. Everybody else has to be checked against all offers first.
+        """
+        return self.active and self.authorized
+
     @staticmethod
     def get_or_create(session, chat_id):
         """Get or create a new subscriber."""
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.dialects.postgresql import insert
+
+from hetznerbot.db import base
+
+
+class VersionStamp(base):
+    """A counter that's bumped whenever some data changes.
+
+    This allows processes to invalidate their in-memory caches.
+    """
+
+    __tablename__ = "version_stamp"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, name):
+        """Create a new version stamp."""
+        self.name = name
+        self.version = 0
+
+    @staticmethod
+    def get_version(session, name):
+        """Get the current version of some data."""
+        stamp = session.get(VersionStamp, name)
+        if stamp is None:
+            return 0
+
+        return stamp.version
+
+    @staticmethod
+    def bump(session, name):
+        """Bump the version of some data. The caller has to commit."""
+        VersionStamp.increment(session.connection(), name)
+
+    @staticmethod
+    def increment(connection, name):
+        """Bump the version of some data with a single atomic statement.
+
+        Missing stamps are created, concurrent increments can't get lost or conflict.
+        """
+        statement = insert(VersionStamp).values(name=name, version=1)
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=["name"],
+                set_={"version": VersionStamp.version + 1},
+            )
+        )
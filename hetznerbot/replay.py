@@ -0,0 +1,140 @@
+"""Offline replay of recorded feed snapshots.
+
+The processing pipeline is run for every snapshot against a scratch database.
+Messages are sent to a stub bot, so no network access is needed at all.
+"""
+
+import time
+from contextlib import contextmanager
+
+from prettytable import PrettyTable
+from sqlalchemy import event, select
+
+from hetznerbot.helper.cpu import cpu_catalog
+from hetznerbot.helper.diff import offer_snapshot
+from hetznerbot.helper.hetzner import (
+    check_offers_for_subscribers,
+    send_offers,
+    update_offers,
+)
+from hetznerbot.helper.snapshot import iter_snapshots
+from hetznerbot.models import Subscriber
+
+STAGES = [
+    ("update_offers", "offers"),
+    ("check_offers_for_subscribers", "subscribers"),
+    ("format_offers/send_offers", "messages"),
+]
+
+
+class StubBot:
+    """Replacement for the telegram bot, which only counts messages."""
+
+    def __init__(self):
+        """Create a new stub bot."""
+        self.messages = 0
+
+    async def sendMessage(self, chat_id, text, **kwargs):
+        """Pretend to send a message."""
+        self.messages += 1
+
+    send_message = sendMessage
+
+
+class Replay:
+    """Replay snapshots and collect statistics for each stage of the pipeline."""
+
+    def __init__(self, engine):
+        """Create a new replay, which counts all queries of the given engine."""
+        self.bot = StubBot()
+        self.queries = 0
+        self.snapshots = 0
+        self.stats = {
+            name: {"seconds": 0.0, "queries": 0, "items": 0} for name, _ in STAGES
+        }
+
+        event.listen(engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        """Count every statement that is sent to the database."""
+        self.queries += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the wall time and the queries of a single stage."""
+        stats = self.stats[name]
+        queries = self.queries
+        start = time.perf_counter()
+        yield stats
+        stats["seconds"] += time.perf_counter() - start
+        stats["queries"] += self.queries - queries
+
+    async def run(self, session, path):
+        """Run the pipeline for all snapshots in a directory."""
+        # Start with a full diff, just like a freshly started bot.
+        offer_snapshot.clear()
+        for name, offers in iter_snapshots(path):
+            print(f"Replaying {name} ({len(offers)} offers)")
+            await self.run_snapshot(session, offers)
+
+    async def run_snapshot(self, session, offers):
+        """Run the pipeline for a single snapshot."""
+        cpu_catalog.refresh(session)
+
+        with self.stage("update_offers") as stats:
+            diff = update_offers(session, offers)
+            stats["items"] += len(offers)
+
+        with self.stage("check_offers_for_subscribers") as stats:
+            if not diff.is_empty():
+                check_offers_for_subscribers(session, diff)
+
+        query = (
+            select(Subscriber)
+            .filter(Subscriber.authorized.is_(True))
+            .filter(Subscriber.active.is_(True))
+        )
+        subscribers = session.scalars(query).all()
+        self.stats["check_offers_for_subscribers"]["items"] += len(subscribers)
+
+        with self.stage("format_offers/send_offers") as stats:
+            messages = self.bot.messages
+            for subscriber in subscribers:
+                await send_offers(self.bot, subscriber, session)
+            session.commit()
+            stats["items"] += self.bot.messages - messages
+
+        offer_snapshot.apply(diff)
+        self.snapshots += 1
+
+    def get_report(self):
+        """Format the collected statistics as a table."""
+        table = PrettyTable()
+        table.field_names = [
+            "Stage",
+            "Total (s)",
+            "Per snapshot (ms)",
+            "Queries",
+            "Queries per snapshot",
+            "Throughput",
+        ]
+        table.align = "r"
+        table.align["Stage"] = "l"
+
+        snapshots = max(self.snapshots, 1)
+        for name, unit in STAGES:
+            stats = self.stats[name]
+            seconds = stats["seconds"]
+            throughput = stats["items"] / seconds if seconds > 0 else 0
+            table.add_row(
+                [
+                    name,
+                    f"{seconds:.3f}",
+                    f"{seconds * 1000 / snapshots:.1f}",
+                    stats["queries"],
+                    f"{stats['queries'] / snapshots:.1f}",
+                    f"{throughput:.1f} {unit}/s",
+                ]
+            )
+
+        return f"Replayed {self.snapshots} snapshots\n{table.get_string()}"
@@ -1,5 +1,7 @@
 """Simple wrapper around sentry that allows for lazy initilization."""
 
+from contextlib import contextmanager
+
 import sentry_sdk
 from sentry_sdk import configure_scope
 
@@ -17,13 +19,17 @@ class Sentry:
     """
 
     initialized = False
+    tracing = False
 
     def __init__(self):
         """Construct new sentry wrapper."""
         if config["logging"]["sentry_enabled"]:
             self.initialized = True
+            sample_rate = config["logging"]["sentry_traces_sample_rate"]
+            self.tracing = sample_rate > 0
             sentry_sdk.init(
                 config["logging"]["sentry_token"],
+                traces_sample_rate=sample_rate if self.tracing else None,
             )
 
     def capture_message(self, message, level="info", tags=None, extra=None):
@@ -60,5 +66,27 @@ class Sentry:
             scope.set_tag("bot", "pollbot")
             sentry_sdk.capture_exception()
 
+    @contextmanager
+    def transaction(self, name, op):
+        """Trace everything within the block as a single transaction."""
+        if not self.tracing:
+            yield
+            return
+
+        with sentry_sdk.start_transaction(name=name, op=op):
+            yield
+
+    @contextmanager
+    def span(self, op, description=None, **data):
+        """Trace the block as a child span of the current transaction or span."""
+        if not self.tracing:
+            yield
+            return
+
+        with sentry_sdk.start_span(op=op, name=description) as span:
+            for key, value in data.items():
+                span.set_data(key, value)
+            yield
+
 
 sentry = Sentry()
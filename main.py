@@ -2,17 +2,24 @@
 """The main entry point for the bot."""
 
 from contextlib import contextmanager
+import asyncio
 import json
-import csv
+from json import JSONDecodeError
 
 import typer
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy_utils.functions import database_exists, create_database, drop_database
 
 from hetznerbot.config import config
 from hetznerbot.db import engine, base, get_session
 from hetznerbot.models import *  # noqa
 from hetznerbot.hetznerbot import init_app
+from hetznerbot.helper.cpu import import_cpu_csv
+from hetznerbot.helper import history
+from hetznerbot.helper.feed import hetzner_feed
 from hetznerbot.helper.hetzner import get_hetzner_offers, update_offers
+from hetznerbot.helper.snapshot import get_snapshot_dir
 
 cli = typer.Typer()
 
@@ -24,12 +31,29 @@ def wrap_echo(msg: str):
     typer.echo("done.")
 
 
+def fetch_offers():
+    """Fetch the current offers from outside of the bot's event loop."""
+
+    async def fetch():
+        try:
+            return await get_hetzner_offers()
+        finally:
+            await hetzner_feed.close()
+
+    return asyncio.run(fetch())
+
+
 @cli.command()
 def dump_offers():
     """Download the current live Hetzner offer data to ./offers.json."""
-    offers = get_hetzner_offers()
+    offers = fetch_offers()
     if offers is None:
         raise typer.Exit(code=1)
+    try:
+        offers = list(offers)
+    except (JSONDecodeError, UnicodeDecodeError):
+        print("Failed to decode json.")
+        raise typer.Exit(code=1)
 
     with open("offers.json", "w") as f:
         json.dump(offers, f, indent=2)
@@ -39,13 +63,17 @@ def dump_offers():
 @cli.command()
 def pull_offers():
     """Download live Hetzner offers and update the database."""
-    incoming_offers = get_hetzner_offers()
+    incoming_offers = fetch_offers()
     if incoming_offers is None:
         raise typer.Exit(code=1)
 
     session = get_session()
-    offers = update_offers(session, incoming_offers)
-    typer.echo(f"Updated {len(offers)} offers in the database.")
+    try:
+        diff = update_offers(session, incoming_offers)
+    except (JSONDecodeError, UnicodeDecodeError):
+        print("Failed to decode json.")
+        raise typer.Exit(code=1)
+    typer.echo(f"Updated {len(diff.records)} offers in the database.")
 
 
 @cli.command()
@@ -84,6 +112,11 @@ def initdb(exist_ok: bool = False, drop_existing: bool = False):
 @cli.command()
 def run():
     """Actually start the bot."""
+    # Replicas can't poll for updates at the same time.
+    if config["cluster"]["enabled"] and not config["webhook"]["enabled"]:
+        typer.echo("The cluster mode requires the webhook mode.", err=True)
+        raise typer.Exit(code=1)
+
     app = init_app()
 
     if config["webhook"]["enabled"]:
@@ -107,32 +140,196 @@ def run():
 def import_cpu_data():
     """Import cpu data from the ./data/cpu_data.csv."""
     session = get_session()
+    import_cpu_csv(session)
+
+
+@cli.command()
+def compact_history(
+    full: bool = typer.Option(
+        False, help="Downsample the whole history instead of the most recent days."
+    ),
+):
+    """Delete expired offer history and downsample old price changes."""
+    session = get_session()
+    deleted = history.compact_history(session, full=full)
+    typer.echo(f"Deleted {deleted} history entries.")
+
+
+@cli.command()
+def replay(
+    sql_uri: str = typer.Argument(help="Scratch database, which will be modified."),
+    snapshot_dir: str = typer.Option(None, help="Defaults to the recorder path."),
+    copy_subscribers: bool = typer.Option(
+        False, help="Copy all subscribers from the configured database."
+    ),
+):
+    """Replay recorded feed snapshots against a scratch database.
+
+    Runs the processing pipeline for each snapshot with a stub bot and reports
+    wall time, database queries and throughput for each stage.
+    """
+    from hetznerbot.replay import Replay
 
-    with open("data/cpu_data.csv", newline="") as csvfile:
-        reader = csv.DictReader(csvfile)
-        known_cpus = []
-        for row in reader:
-            # Check for duplicate entries in data
-            if row["name"] in known_cpus:
-                print(f"DUPLICATE CPU: {row['name']}")
-                continue
-            known_cpus.append(row["name"])
-
-            cpu = session.get(Cpu, row["name"])
-
-            if cpu is None:
-                print(f"Adding new CPU {row['name']}")
-                cpu = Cpu(row["name"].strip())
-                session.add(cpu)
-            else:
-                print(f"Updating existing CPU {row['name']}")
-
-            cpu.threads = row["threads"].strip()
-            cpu.release_date = row["release_date"].strip()
-            cpu.multi_thread_rating = row["multi_thread_rating"].strip()
-            cpu.single_thread_rating = row["single_thread_rating"].strip()
+    if sql_uri == config["database"]["sql_uri"]:
+        typer.echo("Refusing to replay against the configured database.", err=True)
+        raise typer.Exit(code=1)
 
+    scratch_engine = create_engine(sql_uri)
+    if not database_exists(scratch_engine.url):
+        create_database(scratch_engine.url)
+    base.metadata.create_all(bind=scratch_engine)
+
+    session = sessionmaker(bind=scratch_engine)()
+    import_cpu_csv(session, verbose=False)
+
+    if copy_subscribers:
+        rows = get_session().execute(select(Subscriber.__table__)).mappings().all()
+        session.execute(delete(Subscriber))
+        if len(rows) > 0:
+            session.execute(insert(Subscriber), [dict(row) for row in rows])
         session.commit()
+        typer.echo(f"Copied {len(rows)} subscribers.")
+
+    replay = Replay(scratch_engine)
+    asyncio.run(replay.run(session, snapshot_dir or get_snapshot_dir()))
+    session.close()
+
+    typer.echo(replay.get_report())
+
+
+@cli.command()
+def benchmark(
+    sql_uri: str = typer.Argument(help="Scratch database, which will be recreated."),
+    offers: str = typer.Option("100,1000,5000", help="Comma separated offer counts."),
+    subscribers: str = typer.Option(
+        "10,100,1000", help="Comma separated subscriber counts."
+    ),
+    seed: int = typer.Option(0, help="Seed of the synthetic workload."),
+    output: str = typer.Option(None, help="Write the JSON results to this file."),
+):
+    """Benchmark the offer pipeline with a synthetic workload.
+
+    Times each stage for all combinations of offer and subscriber counts
+    and emits the results as JSON.
+    """
+    from hetznerbot.benchmark import Benchmark
+
+    if sql_uri == config["database"]["sql_uri"]:
+        typer.echo("Refusing to benchmark against the configured database.", err=True)
+        raise typer.Exit(code=1)
+
+    scratch_engine = create_engine(sql_uri)
+    if not database_exists(scratch_engine.url):
+        create_database(scratch_engine.url)
+
+    benchmark = Benchmark(scratch_engine, sessionmaker(bind=scratch_engine), seed)
+    benchmark.run(
+        [int(count) for count in offers.split(",")],
+        [int(count) for count in subscribers.split(",")],
+    )
+
+    report = json.dumps(benchmark.get_report(), indent=2)
+    if output is None:
+        typer.echo(report)
+    else:
+        with open(output, "w") as f:
+            f.write(report)
+        typer.echo(f"Wrote the results to {output}")
+
+
+def get_fake_telegram(
+    latency, retry_after_rate, forbidden_rate, not_found_rate, flood_limit
+):
+    """Create a fake Telegram server from the command line options."""
+    from hetznerbot.fake_telegram import FakeTelegram
+
+    return FakeTelegram(
+        latency=latency / 1000,
+        retry_after_rate=retry_after_rate,
+        forbidden_rate=forbidden_rate,
+        not_found_rate=not_found_rate,
+        flood_limit=flood_limit,
+    )
+
+
+@cli.command()
+def fake_telegram(
+    port: int = typer.Option(8081),
+    latency: float = typer.Option(50, help="Mean latency in milliseconds."),
+    retry_after_rate: float = typer.Option(0.0, help="Share of flood control errors."),
+    forbidden_rate: float = typer.Option(
+        0.0, help="Share of chats that blocked the bot."
+    ),
+    not_found_rate: float = typer.Option(0.0, help="Share of chats that don't exist."),
+    flood_limit: int = typer.Option(0, help="Messages per second until flood control."),
+):
+    """Serve a fake Telegram Bot API for load tests.
+
+    Set `telegram.base_url` to "http://127.0.0.1:<port>/bot" to use it.
+    """
+    fake = get_fake_telegram(
+        latency, retry_after_rate, forbidden_rate, not_found_rate, flood_limit
+    )
+
+    async def serve():
+        fake.start("127.0.0.1", port)
+        typer.echo(f"Serving a fake Bot API on http://127.0.0.1:{port}/bot")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+@cli.command()
+def loadtest(
+    sql_uri: str = typer.Argument(help="Scratch database, which will be recreated."),
+    offers: int = typer.Option(1000),
+    subscribers: int = typer.Option(2000),
+    port: int = typer.Option(8081, help="Port of the fake Telegram server."),
+    latency: float = typer.Option(50, help="Mean latency in milliseconds."),
+    retry_after_rate: float = typer.Option(0.0, help="Share of flood control errors."),
+    forbidden_rate: float = typer.Option(
+        0.0, help="Share of chats that blocked the bot."
+    ),
+    not_found_rate: float = typer.Option(0.0, help="Share of chats that don't exist."),
+    flood_limit: int = typer.Option(0, help="Messages per second until flood control."),
+    global_rate: float = typer.Option(None, help="Overrides dispatch.global_rate."),
+    chat_rate: float = typer.Option(None, help="Overrides dispatch.chat_rate."),
+):
+    """Load test the delivery of notifications against a fake Telegram server.
+
+    Matches a synthetic workload against a scratch database and delivers all
+    notifications through the dispatcher. Reports messages per second and
+    tail latency.
+    """
+    from hetznerbot.loadtest import LoadTest
+
+    if sql_uri == config["database"]["sql_uri"]:
+        typer.echo("Refusing to load test against the configured database.", err=True)
+        raise typer.Exit(code=1)
+
+    if global_rate is not None:
+        config["dispatch"]["global_rate"] = global_rate
+    if chat_rate is not None:
+        config["dispatch"]["chat_rate"] = chat_rate
+
+    scratch_engine = create_engine(sql_uri)
+    if not database_exists(scratch_engine.url):
+        create_database(scratch_engine.url)
+
+    fake = get_fake_telegram(
+        latency, retry_after_rate, forbidden_rate, not_found_rate, flood_limit
+    )
+    loadtest = LoadTest(scratch_engine, sessionmaker(bind=scratch_engine), fake)
+
+    async def run():
+        fake.start("127.0.0.1", port)
+        try:
+            await loadtest.run(f"http://127.0.0.1:{port}/bot", offers, subscribers)
+        finally:
+            fake.stop()
+
+    asyncio.run(run())
+    typer.echo(loadtest.get_report())
 
 
 if __name__ == "__main__":
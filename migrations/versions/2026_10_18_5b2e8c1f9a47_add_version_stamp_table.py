@@ -0,0 +1,29 @@
+"""add version stamp table
+
+Revision ID: 5b2e8c1f9a47
+Revises: d326ab6edf69
+Create Date: 2026-10-18 15:02:44.318120
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b2e8c1f9a47"
+down_revision = "d326ab6edf69"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "version_stamp",
+        sa.Column("name", sa.String(), nullable=False, primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("version_stamp")
@@ -0,0 +1,65 @@
+"""add notification outbox
+
+Revision ID: 7c3d91e5a2f6
+Revises: e41c7a93b0d8
+Create Date: 2026-10-18 18:41:07.522913
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c3d91e5a2f6"
+down_revision = "e41c7a93b0d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "notification",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("offer_subscriber_id", sa.Integer(), nullable=False),
+        sa.Column("version", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column(
+            "next_attempt_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "created_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.ForeignKeyConstraint(
+            ["offer_subscriber_id"], ["offer_subscriber.id"], ondelete="cascade"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("offer_subscriber_id"),
+    )
+    op.create_index(
+        op.f("ix_notification_next_attempt_at"),
+        "notification",
+        ["next_attempt_at"],
+        unique=False,
+    )
+
+    # Offers that haven't been sent yet are delivered through the outbox from now on.
+    op.execute(
+        """
+        INSERT INTO notification (offer_subscriber_id)
+        SELECT offer_subscriber.id
+        FROM offer_subscriber
+        JOIN subscriber ON subscriber.chat_id = offer_subscriber.subscriber_id
+        WHERE NOT offer_subscriber.notified
+            AND subscriber.active
+            AND subscriber.authorized
+        """
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_notification_next_attempt_at"), table_name="notification")
+    op.drop_table("notification")
@@ -0,0 +1,69 @@
+"""add offer history
+
+Revision ID: aabc825d30a6
+Revises: 7c3d91e5a2f6
+Create Date: 2026-10-18 21:12:44.187305
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "aabc825d30a6"
+down_revision = "7c3d91e5a2f6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "offer_history",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("offer_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "event",
+            sa.Enum("added", "changed", "removed", name="offerevent"),
+            nullable=False,
+        ),
+        sa.Column("price", sa.Integer(), nullable=False),
+        sa.Column(
+            "recorded_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_offer_history_recorded_at",
+        "offer_history",
+        ["recorded_at"],
+        unique=False,
+        postgresql_using="brin",
+    )
+    op.create_index(
+        "ix_offer_history_offer_id_recorded_at",
+        "offer_history",
+        ["offer_id", "recorded_at"],
+        unique=False,
+    )
+
+    # Start the history of all active offers with the time they've been first seen.
+    op.execute(
+        """
+        INSERT INTO offer_history (offer_id, event, price, recorded_at)
+        SELECT id, 'added', price, first_seen_at
+        FROM offer
+        WHERE NOT deactivated
+        ORDER BY first_seen_at
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_offer_history_offer_id_recorded_at", table_name="offer_history")
+    op.drop_index("ix_offer_history_recorded_at", table_name="offer_history")
+    op.drop_table("offer_history")
+    sa.Enum(name="offerevent").drop(op.get_bind())
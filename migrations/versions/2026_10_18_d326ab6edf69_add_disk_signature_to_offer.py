@@ -0,0 +1,53 @@
+"""add disk signature to offer
+
+Revision ID: d326ab6edf69
+Revises: 9b7a4d5f4c2e
+Create Date: 2026-10-18 12:31:07.412095
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d326ab6edf69"
+down_revision = "9b7a4d5f4c2e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "offer",
+        sa.Column("disk_signature", sa.String(), nullable=True),
+    )
+    # Same format as `get_disk_signature`, e.g. `hdd:2000x2,nvme:512x1`.
+    # If the ordering differs for some reason, the disks of the affected offers
+    # are simply rewritten once by the next feed update.
+    op.execute(
+        """
+UPDATE offer SET disk_signature = COALESCE(
+    (
+        SELECT string_agg(
+            offer_disk.type::text || ':' || offer_disk.size || 'x' || offer_disk.amount,
+            ','
+            ORDER BY offer_disk.type::text, offer_disk.size, offer_disk.amount
+        )
+        FROM offer_disk
+        WHERE offer_disk.offer_id = offer.id
+    ),
+    ''
+)
+    """
+    )
+    op.alter_column(
+        "offer",
+        "disk_signature",
+        nullable=False,
+        server_default="",
+    )
+
+
+def downgrade():
+    op.drop_column("offer", "disk_signature")
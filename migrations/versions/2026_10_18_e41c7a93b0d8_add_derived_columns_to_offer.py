@@ -0,0 +1,102 @@
+"""add derived columns to offer
+
+Revision ID: e41c7a93b0d8
+Revises: 5b2e8c1f9a47
+Create Date: 2026-10-18 16:20:13.905431
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e41c7a93b0d8"
+down_revision = "5b2e8c1f9a47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "offer",
+        sa.Column("disk_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column("offer", sa.Column("smallest_disk_size", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("largest_disk_size", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("raid5_capacity", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("raid6_capacity", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("cpu_threads", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("cpu_release_date", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("cpu_multi_rating", sa.Integer(), nullable=True))
+    op.add_column("offer", sa.Column("cpu_single_rating", sa.Integer(), nullable=True))
+
+    # Same values as `get_disk_stats`.
+    op.execute(
+        """
+UPDATE offer SET
+    disk_count = disks.disk_count,
+    smallest_disk_size = disks.smallest_disk_size,
+    largest_disk_size = disks.largest_disk_size,
+    raid5_capacity = disks.raid5_capacity,
+    raid6_capacity = disks.raid6_capacity
+FROM (
+    SELECT
+        offer_id,
+        SUM(amount) AS disk_count,
+        MIN(size) AS smallest_disk_size,
+        MAX(size) AS largest_disk_size,
+        MAX(CASE WHEN amount >= 3 THEN (amount - 1) * size END) AS raid5_capacity,
+        MAX(CASE WHEN amount >= 4 THEN (amount - 2) * size END) AS raid6_capacity
+    FROM offer_disk
+    GROUP BY offer_id
+) AS disks
+WHERE disks.offer_id = offer.id
+    """
+    )
+    op.execute(
+        """
+UPDATE offer SET
+    cpu_threads = cpu.threads,
+    cpu_release_date = cpu.release_date,
+    cpu_multi_rating = cpu.multi_thread_rating,
+    cpu_single_rating = cpu.single_thread_rating
+FROM cpu
+WHERE cpu.name = offer.cpu
+    """
+    )
+
+    op.create_index(
+        "ix_offer_active_price_ram",
+        "offer",
+        ["price", "ram"],
+        postgresql_where=sa.text("NOT deactivated"),
+    )
+    op.create_index(
+        "ix_offer_active_disks",
+        "offer",
+        ["largest_disk_size", "disk_count"],
+        postgresql_where=sa.text("NOT deactivated"),
+    )
+    op.create_index(
+        "ix_offer_active_cpu",
+        "offer",
+        ["cpu_multi_rating", "cpu_single_rating"],
+        postgresql_where=sa.text("NOT deactivated"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_offer_active_cpu", table_name="offer")
+    op.drop_index("ix_offer_active_disks", table_name="offer")
+    op.drop_index("ix_offer_active_price_ram", table_name="offer")
+
+    op.drop_column("offer", "cpu_single_rating")
+    op.drop_column("offer", "cpu_multi_rating")
+    op.drop_column("offer", "cpu_release_date")
+    op.drop_column("offer", "cpu_threads")
+    op.drop_column("offer", "raid6_capacity")
+    op.drop_column("offer", "raid5_capacity")
+    op.drop_column("offer", "largest_disk_size")
+    op.drop_column("offer", "smallest_disk_size")
+    op.drop_column("offer", "disk_count")